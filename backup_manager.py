@@ -1,31 +1,86 @@
 import os
+import re
 import glob
+import logging
 import threading
 import time
 import signal
-from drive_utils import upload_file, download_file, list_files_in_drive
+from concurrent.futures import ThreadPoolExecutor
+from storage_backends import get_backend
 from database import get_user
+from broadcast import broadcast
+from backup_sync import (
+    CHUNK_PREFIX, MANIFEST_PREFIX, PACK_PREFIX, RESTORE_TMP_PREFIX, RESTORE_WORKERS, IncrementalBackup,
+)
 
 BACKUP_INTERVAL = 60  # seconds
+# Seconds the maintenance notice may take; SIGTERM gives the process ~30s in total
+MAINTENANCE_BROADCAST_DEADLINE = 20
+MAINTENANCE_MESSAGE = "⚠️ Bot maintenance in progress, please hold on..."
+ONLINE_MESSAGE = "✅ Bot is back online, you may continue."
 LOCAL_DB = 'bot.db'
 LOCAL_JSONS = glob.glob('*.json')
+# Post segments, link logs and media; packed into compressed chunks by backup_sync
+STORAGE_DIR = 'storage'
+# posts_12.jsonl, links_3.jsonl...: numbered segments, only the newest of which is written to
+SEGMENT_NAME = re.compile(r'^(?P<series>.+)_(?P<number>\d+)(?P<ext>\.\w+)$')
+# Attempts at each part of a restore, and the pause between them; startup waits on the
+# critical part, so it retries sooner
+RESTORE_RETRIES = 3
+RESTORE_RETRY_DELAY = 30
+CRITICAL_RESTORE_RETRY_DELAY = 5
 
-# Set these from env or config
-FOLDER_ID = os.environ.get('GDRIVE_FOLDER_ID', 'YOUR_FOLDER_ID_HERE')
+def storage_files():
+    paths = []
+    for root, _, files in os.walk(STORAGE_DIR):
+        # Skip files a restore is still writing
+        paths.extend(os.path.join(root, name) for name in files if not name.startswith(RESTORE_TMP_PREFIX))
+    return sorted(paths)
+
+def critical_files(names):
+    """What must be restored before the bot serves: root files (bot.db, *.json) and the newest segment of each series."""
+    critical = {name for name in names if os.sep not in name}
+    newest = {}
+    for name in names:
+        match = SEGMENT_NAME.match(os.path.basename(name))
+        if match:
+            series = (os.path.dirname(name), match['series'], match['ext'])
+            number = int(match['number'])
+            if series not in newest or number > newest[series][0]:
+                newest[series] = (number, name)
+    critical.update(name for _, name in newest.values())
+    return critical
 
 class BackupManager:
-    def __init__(self, bot_app=None):
+    def __init__(self, bot_app=None, storage=None):
         self.shutdown_flag = threading.Event()
         self.bot_app = bot_app
+        # Google Drive or a local directory (BACKUP_BACKEND); pass one in to override
+        self.storage = storage or get_backend()
+        self.backup = IncrementalBackup(
+            self.storage.upload, self.storage.download, self.storage.list, db_path=LOCAL_DB,
+            delete=self.storage.delete,
+        )
+        # Set once the background part of the restore has finished (or there was none)
+        self.restored = threading.Event()
+        # Manifest entries of files still being restored, kept in backups made meanwhile
+        self.pending_restore = None
         signal.signal(signal.SIGTERM, self.handle_sigterm)
         self.thread = threading.Thread(target=self.run, daemon=True)
 
     def start(self):
+        # Returns once bot.db and the other critical files are in place (raises if they can't
+        # be restored); storage/ may still be restoring
         self.sync_from_drive()
         self.thread.start()
         self.broadcast_online()
 
+    def wait_restored(self, timeout=None):
+        return self.restored.wait(timeout)
+
     def run(self):
+        # Periodic backups start after the restore, so they don't compete with it for bandwidth
+        self.restored.wait()
         while not self.shutdown_flag.is_set():
             self.sync_to_drive()
             time.sleep(BACKUP_INTERVAL)
@@ -35,53 +90,104 @@ class BackupManager:
         self.broadcast_maintenance()
         self.shutdown_flag.set()
 
+    @staticmethod
+    def _retry(label, delay, func):
+        # func()'s result; after RESTORE_RETRIES failed attempts the last error is raised
+        for attempt in range(RESTORE_RETRIES):
+            try:
+                return func()
+            except Exception as e:
+                logging.warning(f"{label} failed (attempt {attempt + 1}/{RESTORE_RETRIES}): {e}")
+                if attempt + 1 == RESTORE_RETRIES:
+                    raise
+                time.sleep(delay)
+
     def sync_from_drive(self):
-        # Download DB and all JSONs from Drive
-        for fname in [LOCAL_DB] + glob.glob('*.json'):
+        """
+        Restore the critical files from the latest backup manifest now, the rest in the
+        background. Raises if the manifest or a critical file can't be fetched: starting
+        without bot.db would create an empty one, and the next backup would make that
+        the latest snapshot.
+        """
+        manifest = self._retry('Loading the backup manifest', CRITICAL_RESTORE_RETRY_DELAY, self.backup.load_manifest)
+        if manifest is None:
+            self.restore_by_name()
+            self.restored.set()
+            return
+        critical = sorted(critical_files(manifest['files']))
+        try:
+            self._retry(
+                'Restore of critical files', CRITICAL_RESTORE_RETRY_DELAY,
+                lambda: self.backup.restore(manifest=manifest, names=critical),
+            )
+        except Exception as e:
+            raise RuntimeError(f"Could not restore {', '.join(critical)} from the backup: {e}") from e
+        rest = sorted(name for name in manifest['files'] if name not in critical)
+        self.pending_restore = {name: manifest['files'][name] for name in rest}
+        threading.Thread(
+            target=self.restore_in_background, args=(manifest, rest, time.time()), daemon=True
+        ).start()
+
+    def restore_in_background(self, manifest, names, started):
+        # Files the bot has written since `started` are newer than the backup and kept
+        try:
+            self._retry(
+                'Background restore', RESTORE_RETRY_DELAY,
+                lambda: self.backup.restore(manifest=manifest, names=names, keep_newer_than=started),
+            )
+            self.pending_restore = None
+        except Exception:
+            # Files that never arrived stay in later manifests, for the next start to retry
+            self.pending_restore = {
+                name: entry for name, entry in self.pending_restore.items() if not os.path.exists(name)
+            }
+        finally:
+            self.restored.set()
+
+    def restore_by_name(self):
+        # Backups made before manifests: every file the remote has under its own name
+        try:
+            names = [
+                name for name in self.storage.list()
+                if not name.startswith((CHUNK_PREFIX, PACK_PREFIX, MANIFEST_PREFIX))
+            ]
+        except Exception as e:
+            logging.warning(f"Listing the backup folder failed: {e}")
+            return
+
+        def fetch(name):
+            tmp = name + '.download'
             try:
-                download_file(fname, fname)
-            except Exception:
-                pass
+                if self.storage.download(name, tmp):
+                    os.replace(tmp, name)
+            except Exception as e:
+                logging.warning(f"Downloading {name} failed: {e}")
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+
+        with ThreadPoolExecutor(RESTORE_WORKERS) as pool:
+            list(pool.map(fetch, names))
 
     def sync_to_drive(self):
-        # Upload DB and all JSONs to Drive
-        for fname in [LOCAL_DB] + glob.glob('*.json'):
-            if os.path.exists(fname):
-                try:
-                    upload_file(fname, fname)
-                except Exception:
-                    pass
+        # Upload the chunks of DB, JSON and storage/ files that changed since the last backup
+        try:
+            self.backup.run(
+                [LOCAL_DB] + sorted(glob.glob('*.json')) + storage_files(), carry_over=self.pending_restore
+            )
+        except Exception as e:
+            logging.warning(f"Backup failed: {e}")
 
     def broadcast_maintenance(self):
-        # Send maintenance message to all users in DB
+        # Send maintenance message to all users in DB, within the SIGTERM grace period
         if self.bot_app:
             import asyncio
-            async def send_all():
-                from database import DB_PATH
-                import aiosqlite
-                async with aiosqlite.connect(DB_PATH) as db:
-                    cursor = await db.execute('SELECT user_id FROM users')
-                    rows = await cursor.fetchall()
-                    for row in rows:
-                        try:
-                            await self.bot_app.bot.send_message(row[0], "⚠️ Bot maintenance in progress, please hold on...")
-                        except Exception:
-                            pass
-            asyncio.run(send_all())
+            asyncio.run(broadcast(
+                self.bot_app.bot, MAINTENANCE_MESSAGE, 'maintenance', deadline=MAINTENANCE_BROADCAST_DEADLINE
+            ))
 
     def broadcast_online(self):
-        # Send online message to all users in DB
+        # Send online message to all users in DB; resumes a run cut short by a restart
         if self.bot_app:
             import asyncio
-            async def send_all():
-                from database import DB_PATH
-                import aiosqlite
-                async with aiosqlite.connect(DB_PATH) as db:
-                    cursor = await db.execute('SELECT user_id FROM users')
-                    rows = await cursor.fetchall()
-                    for row in rows:
-                        try:
-                            await self.bot_app.bot.send_message(row[0], "✅ Bot is back online, you may continue.")
-                        except Exception:
-                            pass
-            asyncio.run(send_all())
+            asyncio.run(broadcast(self.bot_app.bot, ONLINE_MESSAGE, 'online'))
@@ -0,0 +1,674 @@
+"""
+backup_sync.py
+Change-aware incremental backups for BackupManager. Files are split into fixed-size chunks
+identified by their SHA-256, so a backup stores only the chunks the remote doesn't have yet.
+New chunks are zlib-compressed and packed together into content-addressed pack objects
+(pack-<sha256>) of about PACK_SIZE, which are uploaded in parallel; a tree of thousands of
+small files therefore costs a handful of uploads, not one per file. Each backup that
+changed anything writes a manifest listing every file, its chunks and where each chunk
+lives (manifest-<timestamp>.json, plus manifest-latest.json), so any snapshot can be
+restored on its own. Only the newest MANIFEST_RETENTION manifests are kept, and packs no
+kept manifest references are deleted. Chunks stored one per object (chunk-<sha256>) by
+older versions are still read.
+
+Unchanged files are skipped without reading them: size/mtime are compared first. The
+database is checked with PRAGMA data_version instead, which changes whenever another
+connection commits, and is backed up from a consistent snapshot rather than the live file.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+
+STATE_DIR = '.backup'
+STATE_PATH = os.path.join(STATE_DIR, 'state.json')
+# 1 MiB: a multiple of every SQLite page size, so a changed page dirties one chunk
+CHUNK_SIZE = 1 << 20
+CHUNK_PREFIX = 'chunk-'
+PACK_PREFIX = 'pack-'
+MANIFEST_PREFIX = 'manifest-'
+LATEST_MANIFEST = 'manifest-latest.json'
+MANIFEST_VERSION = 2
+# Timestamped manifests kept on the remote; older ones, and packs only they use, are deleted
+MANIFEST_RETENTION = 48
+SNAPSHOT_PATH = os.path.join(STATE_DIR, 'snapshot.db')
+# A pack is sealed and uploaded once its compressed contents reach this size
+PACK_SIZE = 4 << 20
+# Packs uploaded at the same time; sealed packs wait on disk beyond twice this
+UPLOAD_WORKERS = 4
+# Objects downloaded (and files assembled) at the same time during a restore
+RESTORE_WORKERS = 4
+# Files being restored are written next to their target under this prefix, then renamed
+RESTORE_TMP_PREFIX = '.restore-'
+COMPRESS_LEVEL = 6
+# Chunks that don't shrink below this ratio (JPEGs, MP4s...) are stored uncompressed
+MIN_COMPRESSION_GAIN = 0.95
+CODEC_ZLIB = 'zlib'
+CODEC_RAW = 'raw'
+
+
+def chunk_name(digest):
+    return f"{CHUNK_PREFIX}{digest}"
+
+
+def file_chunks(path, chunk_size=CHUNK_SIZE):
+    """Yield (sha256, bytes) for each chunk of a file."""
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(chunk_size), b''):
+            yield hashlib.sha256(data).hexdigest(), data
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    for _, data in file_chunks(path):
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def encode_chunk(data):
+    """Returns (codec, stored bytes): zlib if it saves enough, else the raw data."""
+    compressed = zlib.compress(data, COMPRESS_LEVEL)
+    if len(compressed) < len(data) * MIN_COMPRESSION_GAIN:
+        return CODEC_ZLIB, compressed
+    return CODEC_RAW, data
+
+
+def decode_chunk(codec, stored):
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(stored)
+    if codec == CODEC_RAW:
+        return stored
+    raise ValueError(f"Unknown chunk codec: {codec}")
+
+
+def snapshot_db(db_path, dest=SNAPSHOT_PATH):
+    """
+    Copy a live SQLite DB with the online backup API and verify it with PRAGMA quick_check.
+    The copy is made in one step inside a single read transaction, so it is consistent, and
+    in WAL mode it doesn't block the bot's writers. (VACUUM INTO would also work, but it
+    rewrites the page layout every time, so unchanged data would no longer dedupe into
+    the same chunks.) Returns timing and size figures; raises RuntimeError if the check fails.
+    """
+    start = time.perf_counter()
+    tmp = dest + '.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    src = sqlite3.connect(db_path)
+    dst = sqlite3.connect(tmp)
+    try:
+        src.backup(dst)
+        copied = time.perf_counter()
+        check = dst.execute('PRAGMA quick_check').fetchone()[0]
+    finally:
+        src.close()
+        dst.close()
+    if check != 'ok':
+        os.remove(tmp)
+        raise RuntimeError(f"Snapshot of {db_path} failed quick_check: {check}")
+    os.replace(tmp, dest)
+    return {
+        'taken_at': datetime.now(timezone.utc).isoformat(),
+        'bytes': os.path.getsize(dest),
+        'copy_seconds': round(copied - start, 3),
+        'check_seconds': round(time.perf_counter() - copied, 3),
+    }
+
+
+def _stat_key(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _legacy_location(digest):
+    # A whole chunk-<sha> object holding the raw chunk
+    return [chunk_name(digest), 0, None, CODEC_RAW]
+
+
+def _manifest_objects(manifest):
+    """Sorted names of the remote objects (packs, legacy chunks) a manifest's files need."""
+    locations = manifest.get('locations', {})
+    return sorted({
+        (locations.get(digest) or _legacy_location(digest))[0]
+        for entry in manifest['files'].values() for digest in entry['chunks']
+    })
+
+
+class _Pack:
+    """A pack being filled: compressed chunks appended to a temp file."""
+
+    def __init__(self):
+        fd, self.path = tempfile.mkstemp(dir=STATE_DIR, prefix=PACK_PREFIX)
+        self.file = os.fdopen(fd, 'wb')
+        self.hash = hashlib.sha256()
+        self.size = 0
+        self.raw_size = 0
+        # (digest, offset, length, codec)
+        self.entries = []
+
+    def add(self, digest, data):
+        codec, stored = encode_chunk(data)
+        self.file.write(stored)
+        self.hash.update(stored)
+        self.entries.append((digest, self.size, len(stored), codec))
+        self.size += len(stored)
+        self.raw_size += len(data)
+
+    def close(self):
+        self.file.close()
+        return f"{PACK_PREFIX}{self.hash.hexdigest()}"
+
+
+class IncrementalBackup:
+    """
+    Runs backups against three callables: upload(local_path, remote_name),
+    download(remote_name, local_path) -> bool and list_remote() -> [names]. upload and
+    download are called from several threads at once. With a fourth, delete(remote_name),
+    only the newest keep_manifests manifests are kept and unreferenced packs are deleted.
+    Local state (what each file looked like at the last backup, where on the remote
+    each known chunk is stored, and which objects each kept manifest needs) lives in STATE_PATH.
+    """
+
+    def __init__(self, upload, download, list_remote, db_path=None, state_path=STATE_PATH,
+                 upload_workers=UPLOAD_WORKERS, restore_workers=RESTORE_WORKERS, delete=None,
+                 keep_manifests=MANIFEST_RETENTION):
+        self.upload = upload
+        self.download = download
+        self.list_remote = list_remote
+        self.delete = delete
+        self.keep_manifests = keep_manifests
+        self.db_path = db_path
+        self.state_path = state_path
+        self.upload_workers = upload_workers
+        self.restore_workers = restore_workers
+        self.uploaded_chunks = 0
+        self.uploaded_packs = 0
+        self.uploaded_bytes = 0
+        self.chunk_bytes = 0
+        self.skipped_files = 0
+        self.deleted_manifests = 0
+        self.deleted_objects = 0
+        self._lock = threading.Lock()
+        self._db = None
+        self._data_version = None
+        self.last_snapshot = None
+        self.last_restore = None
+        self._pack = None
+        self._pending = set()
+        self._uploads = []
+        self._state = self._load_state()
+        # Kept for the object's lifetime: a backend that builds a client per thread
+        # (DriveBackend) then builds it once per worker, not on every backup or restore
+        self._upload_pool = ThreadPoolExecutor(upload_workers, thread_name_prefix='backup-upload')
+        self._download_pool = ThreadPoolExecutor(restore_workers, thread_name_prefix='restore-download')
+        self._assembly_pool = ThreadPoolExecutor(restore_workers, thread_name_prefix='restore-file')
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        state.setdefault('files', {})
+        locations = state.setdefault('locations', {})
+        # State written before packs: every known chunk is its own object
+        for digest in state.pop('remote_chunks', []):
+            locations.setdefault(digest, _legacy_location(digest))
+        return state
+
+    def _save_state(self):
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        tmp = self.state_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self._state, f)
+        os.replace(tmp, self.state_path)
+
+    def _discover_remote(self):
+        """First run with no local state: learn which chunks the remote already has."""
+        names = self.list_remote()
+        locations = self._state['locations']
+        for name in names:
+            if name.startswith(CHUNK_PREFIX):
+                locations[name[len(CHUNK_PREFIX):]] = _legacy_location(name[len(CHUNK_PREFIX):])
+        if LATEST_MANIFEST in names:
+            manifest = self._download_manifest(LATEST_MANIFEST)
+            if manifest is not None:
+                locations.update(manifest.get('locations', {}))
+
+    def _db_changed(self):
+        """True if anything committed to the DB since the last call (or if unsure)."""
+        if self.db_path is None or not os.path.exists(self.db_path):
+            return True
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        version = self._db.execute('PRAGMA data_version').fetchone()[0]
+        changed = version != self._data_version
+        self._data_version = version
+        return changed
+
+    def _unchanged(self, name, db_changed):
+        previous = self._state['files'].get(name)
+        if previous is None:
+            return False
+        if name == self.db_path:
+            return not db_changed
+        return previous['stat'] == _stat_key(name)
+
+    def _upload_pack(self, path, name):
+        try:
+            self.upload(path, name)
+        finally:
+            os.remove(path)
+
+    def _seal_pack(self, executor):
+        pack, self._pack = self._pack, None
+        name = pack.close()
+        # Bound the sealed packs waiting on disk
+        while len(self._uploads) >= self.upload_workers * 2:
+            self._collect(wait([f for f, _, _ in self._uploads], return_when=FIRST_COMPLETED).done)
+        self._uploads.append((executor.submit(self._upload_pack, pack.path, name), name, pack))
+
+    def _collect(self, done):
+        """Record the chunk locations of finished pack uploads; re-raises the first failure."""
+        error = None
+        remaining = []
+        for future, name, pack in self._uploads:
+            if future not in done:
+                remaining.append((future, name, pack))
+                continue
+            try:
+                future.result()
+            except Exception as e:
+                error = error or e
+                continue
+            for digest, offset, length, codec in pack.entries:
+                self._state['locations'][digest] = [name, offset, length, codec]
+            self.uploaded_packs += 1
+            self.uploaded_chunks += len(pack.entries)
+            self.uploaded_bytes += pack.size
+            self.chunk_bytes += pack.raw_size
+        self._uploads = remaining
+        if error is not None:
+            raise error
+
+    def _add_chunk(self, executor, digest, data):
+        if digest in self._state['locations'] or digest in self._pending:
+            return
+        if self._pack is None:
+            self._pack = _Pack()
+        self._pack.add(digest, data)
+        self._pending.add(digest)
+        if self._pack.size >= PACK_SIZE:
+            self._seal_pack(executor)
+
+    def _finish_uploads(self, executor):
+        if self._pack is not None:
+            self._seal_pack(executor)
+        try:
+            self._collect(wait([f for f, _, _ in self._uploads]).done)
+        finally:
+            self._uploads = []
+            self._pending.clear()
+
+    def _abort_pack(self):
+        if self._pack is not None:
+            self._pack.file.close()
+            os.remove(self._pack.path)
+            self._pack = None
+
+    def _backup_file(self, executor, name, source=None):
+        """Queue the new chunks of one changed file (read from `source` if given); returns its manifest entry."""
+        source = source or name
+        stat = _stat_key(source)
+        whole = hashlib.sha256()
+        size = 0
+        chunks = []
+        for digest, data in file_chunks(source):
+            whole.update(data)
+            size += len(data)
+            chunks.append(digest)
+            self._add_chunk(executor, digest, data)
+        return {'stat': stat, 'size': size, 'sha256': whole.hexdigest(), 'chunks': chunks}
+
+    def _write_manifest(self, entries, snapshot=None):
+        locations = self._state['locations']
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'chunk_size': CHUNK_SIZE,
+            'snapshot': snapshot,
+            'files': {
+                name: {'size': e['size'], 'sha256': e['sha256'], 'chunks': e['chunks']}
+                for name, e in entries.items()
+            },
+            'locations': {digest: locations[digest] for e in entries.values() for digest in e['chunks']},
+        }
+        path = os.path.join(STATE_DIR, LATEST_MANIFEST)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+        name = f"{MANIFEST_PREFIX}{stamp}.json"
+        self.upload(path, name)
+        self.upload(path, LATEST_MANIFEST)
+        return name, manifest
+
+    def _prune(self, name, manifest):
+        """
+        Record the objects manifest `name` needs, delete manifests beyond keep_manifests and
+        then every pack or chunk object no remaining manifest references. Objects are known
+        from the chunk locations in state (which also covers packs of an interrupted backup);
+        the first prune lists the remote instead, to catch what earlier versions left behind.
+        """
+        manifests = self._state.get('manifests')
+        listing = None
+        if manifests is None:
+            listing = self.list_remote()
+            # Refs of manifests we didn't write are downloaded when needed
+            manifests = self._state['manifests'] = dict.fromkeys(
+                n for n in listing if n.startswith(MANIFEST_PREFIX) and n != LATEST_MANIFEST
+            )
+        manifests[name] = _manifest_objects(manifest)
+        names = sorted(manifests)
+        dropped = names[:-self.keep_manifests] if len(names) > self.keep_manifests else []
+        if not dropped and listing is None:
+            return
+        candidates = {location[0] for location in self._state['locations'].values()}
+        if listing is not None:
+            candidates.update(n for n in listing if n.startswith((PACK_PREFIX, CHUNK_PREFIX)))
+        for old in dropped:
+            candidates.update(manifests[old] or ())
+            self.delete(old)
+            del manifests[old]
+            self.deleted_manifests += 1
+        live = set()
+        for kept in sorted(manifests):
+            if manifests[kept] is None:
+                kept_manifest = self._download_manifest(kept)
+                if kept_manifest is None:
+                    del manifests[kept]
+                    continue
+                manifests[kept] = _manifest_objects(kept_manifest)
+            live.update(manifests[kept])
+        deleted = set()
+        try:
+            for obj in sorted(candidates - live):
+                self.delete(obj)
+                deleted.add(obj)
+        finally:
+            self._forget_objects(deleted)
+        logging.info(f"Backup retention: deleted {len(dropped)} manifests and {len(deleted)} unreferenced objects")
+
+    def _forget_objects(self, deleted):
+        """Drop chunk locations in deleted objects, and file entries that used them, so they are uploaded again."""
+        if not deleted:
+            return
+        self.deleted_objects += len(deleted)
+        locations = self._state['locations'] = {
+            digest: location for digest, location in self._state['locations'].items()
+            if location[0] not in deleted
+        }
+        self._state['files'] = {
+            name: entry for name, entry in self._state['files'].items()
+            if all(digest in locations for digest in entry['chunks'])
+        }
+
+    def run(self, paths, carry_over=None):
+        """
+        Back up the given files; returns the new manifest, or None if nothing changed.
+        carry_over maps names to manifest entries of files that aren't on disk yet (a
+        restore still in progress); they go into the manifest unchanged instead of dropping out.
+        """
+        with self._lock:
+            os.makedirs(STATE_DIR, exist_ok=True)
+            if not self._state['locations'] and not self._state['files']:
+                self._discover_remote()
+            start = time.perf_counter()
+            before = self.stats()
+            db_changed = self._db_changed()
+            paths = [p for p in paths if os.path.exists(p)]
+            entries = {}
+            changed = []
+            snapshot = None
+            try:
+                executor = self._upload_pool
+                try:
+                    for name in paths:
+                        if self._unchanged(name, db_changed):
+                            entries[name] = self._state['files'][name]
+                            self.skipped_files += 1
+                            continue
+                        source = None
+                        if name == self.db_path:
+                            snapshot = self.last_snapshot = snapshot_db(name)
+                            source = SNAPSHOT_PATH
+                            logging.info(f"DB snapshot: {snapshot}")
+                        entries[name] = self._backup_file(executor, name, source)
+                        previous = self._state['files'].get(name)
+                        if previous is None or previous['sha256'] != entries[name]['sha256']:
+                            changed.append(name)
+                except BaseException:
+                    self._abort_pack()
+                    raise
+                finally:
+                    self._finish_uploads(executor)
+            except BaseException:
+                # Keep the locations of packs that did upload; file entries are only
+                # recorded once all of their chunks are stored
+                self._save_state()
+                raise
+            self._state['files'].update(entries)
+            for name, entry in (carry_over or {}).items():
+                entries.setdefault(name, entry)
+            files_changed = set(entries) != set(self._state.get('manifest_files', []))
+            manifest = None
+            if changed or files_changed:
+                name, manifest = self._write_manifest(entries, snapshot)
+                self._state['manifest_files'] = sorted(entries)
+                after = self.stats()
+                logging.info(
+                    f"Backup of {len(entries)} files ({len(changed)} changed) stored "
+                    f"{after['uploaded_chunks'] - before['uploaded_chunks']} new chunks "
+                    f"({after['chunk_bytes'] - before['chunk_bytes']} bytes, "
+                    f"{after['uploaded_bytes'] - before['uploaded_bytes']} compressed) in "
+                    f"{after['uploaded_packs'] - before['uploaded_packs']} packs in {time.perf_counter() - start:.2f}s"
+                )
+                if self.delete is not None:
+                    try:
+                        self._prune(name, manifest)
+                    except Exception as e:
+                        # The backup itself is stored; pruning picks up where it stopped next time
+                        logging.warning(f"Pruning old backups failed: {e}")
+            self._save_state()
+            return manifest
+
+    def _download_manifest(self, manifest_name):
+        path = os.path.join(STATE_DIR, manifest_name)
+        if not self.download(manifest_name, path):
+            return None
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def snapshots(self):
+        """Remote manifest names, oldest first (manifest-latest.json excluded)."""
+        return sorted(
+            n for n in self.list_remote()
+            if n.startswith(MANIFEST_PREFIX) and n != LATEST_MANIFEST
+        )
+
+    def load_manifest(self, manifest_name=LATEST_MANIFEST):
+        """Download a manifest; returns None if the remote doesn't have it."""
+        os.makedirs(STATE_DIR, exist_ok=True)
+        return self._download_manifest(manifest_name)
+
+    def restore(self, target_dir='.', manifest_name=LATEST_MANIFEST, manifest=None, names=None,
+                keep_newer_than=None):
+        """
+        Rebuild files from a manifest (the latest by default, or one already loaded); returns
+        False if the remote doesn't have it. `names` restores only those files. Local files
+        that already match their checksum are left alone, and so are files modified after
+        `keep_newer_than` (a time.time() value): the running bot wrote them.
+        Objects are downloaded on restore_workers threads and each file is assembled and
+        verified as soon as the objects it needs have arrived. Figures are in last_restore.
+        Backups may run meanwhile; see run()'s carry_over.
+        """
+        if manifest is None:
+            manifest = self.load_manifest(manifest_name)
+            if manifest is None:
+                return False
+        start = time.perf_counter()
+        files = manifest['files']
+        # Version 1 manifests have no locations: every chunk is its own object
+        locations = {
+            digest: manifest.get('locations', {}).get(digest) or _legacy_location(digest)
+            for entry in files.values() for digest in entry['chunks']
+        }
+        with self._lock:
+            os.makedirs(STATE_DIR, exist_ok=True)
+            # Every chunk the manifest references is on the remote, restored or not
+            self._state['locations'].update(locations)
+        restore = {'files': 0, 'present': 0, 'kept_newer': 0, 'failed': 0, 'objects': 0, 'bytes': 0}
+        todo = []
+        for name in sorted(files) if names is None else [n for n in names if n in files]:
+            status = self._local_status(os.path.join(target_dir, name), files[name], keep_newer_than)
+            if status is None:
+                todo.append(name)
+                continue
+            restore[status] += 1
+            if status == 'present':
+                self._record_restored(name, files[name], target_dir)
+        error = self._restore_files(todo, files, locations, target_dir, restore)
+        with self._lock:
+            self._state['manifest_files'] = sorted(files)
+            self._save_state()
+        restore['seconds'] = round(time.perf_counter() - start, 2)
+        self.last_restore = restore
+        logging.info(f"Restore from {manifest.get('created_at')}: {restore}")
+        if error is not None:
+            raise error
+        return True
+
+    @staticmethod
+    def _local_status(target, entry, keep_newer_than):
+        """'present' / 'kept_newer' if `target` shouldn't be restored, else None."""
+        try:
+            stat = os.stat(target)
+        except FileNotFoundError:
+            return None
+        if keep_newer_than is not None and stat.st_mtime >= keep_newer_than:
+            return 'kept_newer'
+        if stat.st_size == entry['size'] and _file_sha256(target) == entry['sha256']:
+            return 'present'
+        return None
+
+    def _record_restored(self, name, entry, target_dir):
+        # The restored copy is what the remote has, so the next backup can skip it
+        with self._lock:
+            self._state['files'][name] = dict(entry, stat=_stat_key(os.path.join(target_dir, name)))
+
+    def _restore_files(self, names, files, locations, target_dir, restore):
+        """Download and assemble `names` in parallel; returns the first error, if any."""
+        # Object -> number of files still needing it, so each is deleted once used up
+        refs = {}
+        needs = {}
+        for name in names:
+            needs[name] = list(dict.fromkeys(locations[d][0] for d in files[name]['chunks']))
+            for obj in needs[name]:
+                refs[obj] = refs.get(obj, 0) + 1
+        pack_dir = tempfile.mkdtemp(dir=STATE_DIR, prefix='restore-')
+        refs_lock = threading.Lock()
+
+        def assemble(name, fetched):
+            for obj in needs[name]:
+                fetched[obj].result()
+            self._restore_file(name, files[name], target_dir, locations, pack_dir)
+            with refs_lock:
+                for obj in needs[name]:
+                    refs[obj] -= 1
+                    if refs[obj] == 0:
+                        os.remove(os.path.join(pack_dir, obj))
+
+        error = None
+        try:
+            # Objects are fetched in the order files need them, and files assembled in that order
+            fetched = {obj: self._download_pool.submit(self._fetch_object, obj, pack_dir) for obj in refs}
+            results = [(name, self._assembly_pool.submit(assemble, name, fetched)) for name in names]
+            for name, future in results:
+                try:
+                    future.result()
+                except Exception as e:
+                    logging.warning(f"Restoring {name} failed: {e}")
+                    restore['failed'] += 1
+                    error = error or e
+                    continue
+                restore['files'] += 1
+                self._record_restored(name, files[name], target_dir)
+            for future in fetched.values():
+                if not future.exception():
+                    restore['objects'] += 1
+                    restore['bytes'] += future.result()
+        finally:
+            shutil.rmtree(pack_dir, ignore_errors=True)
+        return error
+
+    def _fetch_object(self, obj, pack_dir):
+        path = os.path.join(pack_dir, obj)
+        if not self.download(obj, path):
+            raise RuntimeError(f"{obj} is missing from the remote")
+        return os.path.getsize(path)
+
+    @staticmethod
+    def _read_chunk(digest, location, pack_dir):
+        """Read one chunk out of its downloaded object and verify it."""
+        obj, offset, length, codec = location
+        with open(os.path.join(pack_dir, obj), 'rb') as f:
+            f.seek(offset)
+            stored = f.read() if length is None else f.read(length)
+        try:
+            data = decode_chunk(codec, stored)
+        except zlib.error:
+            data = None
+        if data is None or hashlib.sha256(data).hexdigest() != digest:
+            raise RuntimeError(f"chunk {digest} in {obj} is corrupt")
+        return data
+
+    def _restore_file(self, name, entry, target_dir, locations, pack_dir):
+        target = os.path.join(target_dir, name)
+        os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target) or '.', prefix=RESTORE_TMP_PREFIX)
+        whole = hashlib.sha256()
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for digest in entry['chunks']:
+                    data = self._read_chunk(digest, locations[digest], pack_dir)
+                    whole.update(data)
+                    out.write(data)
+            if whole.hexdigest() != entry['sha256']:
+                raise RuntimeError(f"{name} does not match its manifest checksum")
+            if name == self.db_path:
+                # A leftover WAL from the old database would be replayed onto the restored one
+                for suffix in ('-wal', '-shm'):
+                    if os.path.exists(target + suffix):
+                        os.remove(target + suffix)
+            os.replace(tmp, target)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def stats(self):
+        return {
+            'uploaded_chunks': self.uploaded_chunks,
+            'uploaded_packs': self.uploaded_packs,
+            'uploaded_bytes': self.uploaded_bytes,
+            'chunk_bytes': self.chunk_bytes,
+            'skipped_files': self.skipped_files,
+            'deleted_manifests': self.deleted_manifests,
+            'deleted_objects': self.deleted_objects,
+            'remote_chunks': len(self._state['locations']),
+        }
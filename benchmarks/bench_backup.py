@@ -0,0 +1,158 @@
+"""
+bench_backup.py
+Offline BackupManager benchmark. Builds a bot.db of the given size, a few JSON files and a
+storage/ tree (post segments, link logs, media) in a temp directory and runs sync_to_drive /
+sync_from_drive against a LocalBackend: full backup, backup with nothing changed, backup
+after a one-row change, backup after appending to a post segment, and a restore (the
+critical files the bot needs to start, then the rest of storage/ in the background).
+
+--latency adds a simulated round trip (ms) to every storage request, to estimate Drive
+timings. --per-call-lookup also charges the extra files().list request the old
+drive_utils made before each upload/download, for comparison with the cached id map.
+
+Run from the repository root:
+    python benchmarks/bench_backup.py [--rows 200000] [--posts 50000] [--media 5]
+                                      [--latency 0] [--per-call-lookup]
+"""
+import argparse
+import json
+import random
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage_backends import LocalBackend
+
+
+class SlowBackend(LocalBackend):
+    """LocalBackend that sleeps `latency` seconds per request (twice with per_call_lookup)."""
+
+    def __init__(self, root, latency, per_call_lookup):
+        super().__init__(root)
+        self.latency = latency
+        self.requests_per_call = 2 if per_call_lookup else 1
+        self.requests = 0
+
+    def _wait(self, requests):
+        self.requests += requests
+        if self.latency:
+            time.sleep(self.latency * requests)
+
+    def upload(self, local_path, remote_name):
+        self._wait(self.requests_per_call)
+        super().upload(local_path, remote_name)
+
+    def download(self, remote_name, local_path):
+        self._wait(self.requests_per_call)
+        return super().download(remote_name, local_path)
+
+    def list(self):
+        self._wait(1)
+        return super().list()
+
+
+def build_storage(path, posts, media):
+    """storage/posts segments of 10k posts, a link log per 1k posts and `media` 1 MiB random files."""
+    rng = random.Random(42)
+    os.makedirs(os.path.join(path, 'storage', 'posts'))
+    os.makedirs(os.path.join(path, 'storage', 'media'))
+    for first in range(0, posts, 10000):
+        with open(os.path.join(path, 'storage', 'posts', f'posts_{first // 10000 + 1}.jsonl'), 'w') as f:
+            for i in range(first, min(posts, first + 10000)):
+                f.write(json.dumps({'post_id': i, 'url': f'https://opr.news/{i}', 'user_id': rng.randint(1, 5000)}) + '\n')
+    for first in range(0, posts, 1000):
+        with open(os.path.join(path, 'storage', f'links_{first // 1000 + 1}.jsonl'), 'w') as f:
+            for i in range(first, min(posts, first + 1000)):
+                f.write(json.dumps({'user_id': rng.randint(1, 5000), 'link': f'https://opr.news/{i}'}) + '\n')
+    for i in range(media):
+        with open(os.path.join(path, 'storage', 'media', f'{i}.jpg'), 'wb') as f:
+            f.write(rng.randbytes(1 << 20))
+
+
+def append_post(path):
+    segments = sorted(os.listdir(os.path.join(path, 'storage', 'posts')))
+    if segments:
+        with open(os.path.join(path, 'storage', 'posts', segments[-1]), 'a') as f:
+            f.write(json.dumps({'post_id': -1, 'url': 'https://opr.news/new'}) + '\n')
+
+
+def build_workdir(path, rows):
+    conn = sqlite3.connect(os.path.join(path, 'bot.db'))
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('CREATE TABLE users (user_id INTEGER PRIMARY KEY, username TEXT, points INTEGER)')
+    conn.executemany(
+        'INSERT INTO users VALUES (?, ?, ?)',
+        ((i, f"user_{i}_{'x' * 40}", i % 100) for i in range(rows)),
+    )
+    conn.commit()
+    conn.close()
+    for name in ('config.json', 'admins.json', 'payments.json'):
+        with open(os.path.join(path, name), 'w') as f:
+            json.dump({'name': name, 'items': list(range(1000))}, f)
+
+
+def touch_one_row(path):
+    conn = sqlite3.connect(os.path.join(path, 'bot.db'))
+    conn.execute('UPDATE users SET points = points + 1 WHERE user_id = 1')
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--posts', type=int, default=50000)
+    parser.add_argument('--media', type=int, default=5, help='1 MiB incompressible files in storage/media')
+    parser.add_argument('--latency', type=float, default=0, help='simulated ms per storage request')
+    parser.add_argument('--per-call-lookup', action='store_true')
+    args = parser.parse_args()
+
+    from backup_manager import BackupManager
+
+    root = tempfile.mkdtemp(prefix='bench_backup_')
+    cwd = os.getcwd()
+    try:
+        work = os.path.join(root, 'work')
+        os.makedirs(work)
+        build_workdir(work, args.rows)
+        build_storage(work, args.posts, args.media)
+        storage = SlowBackend(os.path.join(root, 'remote'), args.latency / 1000, args.per_call_lookup)
+        os.chdir(work)
+        manager = BackupManager(storage=storage)
+        print(f"bot.db: {os.path.getsize('bot.db') / 2**20:.1f} MiB, latency {args.latency:g} ms"
+              f"{', per-call lookup' if args.per_call_lookup else ''}")
+
+        def timed(label, func):
+            requests = storage.requests
+            start = time.perf_counter()
+            func()
+            print(f"{label:<22} {time.perf_counter() - start:8.3f}s  {storage.requests - requests:5d} requests")
+
+        timed('full backup', manager.sync_to_drive)
+        timed('nothing changed', manager.sync_to_drive)
+        touch_one_row(work)
+        timed('one row changed', manager.sync_to_drive)
+        append_post(work)
+        timed('one post appended', manager.sync_to_drive)
+
+        os.chdir(root)
+        restore = os.path.join(root, 'restore')
+        os.makedirs(restore)
+        os.chdir(restore)
+        restorer = BackupManager(storage=storage)
+        timed('restore (critical)', restorer.sync_from_drive)
+        timed('restore (background)', restorer.wait_restored)
+        print(f"restore: {restorer.backup.last_restore}")
+        print(f"stats: {manager.backup.stats()}")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
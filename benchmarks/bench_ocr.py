@@ -0,0 +1,165 @@
+"""
+bench_ocr.py
+Offline OCR benchmark for screenshot verification. Generates synthetic Opera News
+settings screens with PIL (several resolutions, fonts, noise levels, light/dark mode),
+runs them through the same OCR + parsing path as screenshot_handler, and reports
+p50/p95 latency, throughput per core and detection accuracy for each OCR mode.
+
+Needs a local Tesseract install. Run from the repository root:
+    python benchmarks/bench_ocr.py [--samples 40] [--modes raw preprocessed] [--save-dir out/]
+"""
+import argparse
+import glob
+import io
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+import pytesseract
+
+from ocr_preprocess import OCR_MODES, choose_photo, ocr_image
+from extractors import extract_markers
+
+RESOLUTIONS = [(720, 1520), (1080, 2340), (1440, 3200)]
+# Longest side of the sizes Telegram generates for a photo
+TELEGRAM_SIZES = [90, 320, 800, 1280, 2560]
+SETTINGS_ROWS = [
+    "Notifications", "Language", "Country & Region", "Data savings", "Dark theme",
+    "Text size", "Clear history", "Privacy policy", "Terms of service", "Feedback",
+]
+TIMEOUT = 30
+
+
+class FakePhotoSize:
+    """Stand-in for telegram.PhotoSize with the bytes attached."""
+
+    def __init__(self, image):
+        self.width, self.height = image.size
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=87)
+        self.data = buffer.getvalue()
+
+
+def find_fonts():
+    fonts = sorted(glob.glob('/usr/share/fonts/**/*.ttf', recursive=True))
+    return fonts[:5] or [None]
+
+
+def load_font(path, size):
+    if path is None:
+        return ImageFont.load_default(size=size)
+    return ImageFont.truetype(path, size)
+
+
+def make_screen(rng, fonts):
+    """Return (image, expected) for one synthetic settings screen."""
+    width, height = rng.choice(RESOLUTIONS)
+    dark = rng.random() < 0.4
+    background, foreground = ((18, 18, 18), (232, 232, 232)) if dark else ((255, 255, 255), (25, 25, 25))
+    image = Image.new('RGB', (width, height), background)
+    draw = ImageDraw.Draw(image)
+    font_path = rng.choice(fonts)
+    font = load_font(font_path, round(width / 24))
+    small = load_font(font_path, round(width / 32))
+    expected = {
+        'installation_id': ''.join(rng.choices('0123456789abcdef', k=16)),
+        'version': f"{rng.randint(6, 9)}.{rng.randint(0, 30)}.{rng.randint(0, 9)}",
+        'signout': True,
+    }
+    line_height = round(width / 11)
+    y = line_height
+    draw.text((width // 20, y), "Settings", font=load_font(font_path, round(width / 16)), fill=foreground)
+    y += line_height * 2
+    for row in rng.sample(SETTINGS_ROWS, rng.randint(5, len(SETTINGS_ROWS))):
+        draw.text((width // 20, y), row, font=font, fill=foreground)
+        y += line_height
+    y += line_height // 2
+    draw.text((width // 20, y), "About", font=font, fill=foreground)
+    y += line_height
+    draw.text((width // 20, y), f"Version {expected['version']}", font=small, fill=foreground)
+    y += line_height
+    draw.text((width // 20, y), f"Installation ID: {expected['installation_id']}", font=small, fill=foreground)
+    y += line_height * 2
+    draw.text((width // 20, y), "Sign out", font=font, fill=(220, 60, 60))
+    noise = rng.choice([0, 0.01, 0.03])
+    if noise:
+        pixels = image.load()
+        for _ in range(int(width * height * noise)):
+            pixels[rng.randrange(width), rng.randrange(height)] = tuple(rng.randrange(256) for _ in range(3))
+    if rng.random() < 0.3:
+        image = image.filter(ImageFilter.GaussianBlur(0.8))
+    return image, expected
+
+
+def telegram_sizes(image):
+    sizes = []
+    for side in TELEGRAM_SIZES:
+        scale = side / max(image.size)
+        if scale >= 1:
+            sizes.append(FakePhotoSize(image))
+            break
+        sizes.append(FakePhotoSize(image.resize((round(image.width * scale), round(image.height * scale)))))
+    return sizes
+
+
+def run_mode(mode, samples):
+    latencies = []
+    detected = correct = 0
+    for sizes, expected in samples:
+        photo = choose_photo(sizes, mode)
+        start = time.perf_counter()
+        text = ocr_image(Image.open(io.BytesIO(photo.data)), TIMEOUT, mode)
+        result = extract_markers(text)
+        latencies.append(time.perf_counter() - start)
+        if result['installation_id'] and result['version'] and result['signout']:
+            detected += 1
+            found_id = result['installation_id'].replace(' ', '').lower()
+            if expected['installation_id'] in found_id and expected['version'] in result['version']:
+                correct += 1
+    latencies.sort()
+    return {
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p95_ms': latencies[max(0, int(len(latencies) * 0.95) - 1)] * 1000,
+        'per_core_per_s': 1 / statistics.mean(latencies),
+        'detected': detected / len(samples),
+        'correct': correct / len(samples),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', type=int, default=40)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--modes', nargs='+', default=list(OCR_MODES), choices=OCR_MODES)
+    parser.add_argument('--save-dir', help='also write the generated screens here')
+    args = parser.parse_args()
+    try:
+        pytesseract.get_tesseract_version()
+    except Exception as e:
+        print(f"Tesseract is not available: {e}")
+        return 1
+    rng = random.Random(args.seed)
+    fonts = find_fonts()
+    samples = []
+    for i in range(args.samples):
+        image, expected = make_screen(rng, fonts)
+        if args.save_dir:
+            os.makedirs(args.save_dir, exist_ok=True)
+            image.save(os.path.join(args.save_dir, f"screen_{i:03d}.png"))
+        samples.append((telegram_sizes(image), expected))
+    print(f"{args.samples} screens, {len(fonts)} font(s), {os.cpu_count()} cores")
+    print(f"{'mode':>13} | {'p50 ms':>8} | {'p95 ms':>8} | {'img/s/core':>10} | {'detected':>8} | {'correct':>7}")
+    for mode in args.modes:
+        r = run_mode(mode, samples)
+        print(f"{mode:>13} | {r['p50_ms']:>8.0f} | {r['p95_ms']:>8.0f} | {r['per_core_per_s']:>10.2f} | "
+              f"{r['detected']:>8.0%} | {r['correct']:>7.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""
+bench_sample_posts.py
+Compare Gain Points link selection: the old ORDER BY RANDOM() scan versus
+database.sample_unviewed_posts' rowid-range probing, at several table sizes.
+
+Usage: python benchmarks/bench_sample_posts.py [sizes...]   (default 10000 100000 1000000)
+Only the SQL side is timed; the old path also opened a storage shard per link.
+Each size is timed for a viewer with 1000 views and for one who has already seen
+every post, where every probe comes back empty (the worst case for probing).
+"""
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiosqlite
+
+import database
+
+ADMIN_ID = 1
+VIEWER_ID = 2
+# Has viewed every post, so nothing is left to sample
+EXHAUSTED_VIEWER_ID = 5001
+ROUNDS = 20
+
+
+def build_db(path, n_posts):
+    """Fill a fresh DB: 5% admin posts, 10% expired, viewer has seen 1000 posts, the exhausted viewer all of them."""
+    conn = sqlite3.connect(path)
+    with open(database.SCHEMA_PATH) as f:
+        conn.executescript(f.read())
+    for _, _, migration in database.list_migrations(database.MIGRATIONS_DIR):
+        if not migration.endswith('.sql'):
+            continue
+        with open(migration) as f:
+            conn.executescript(f.read())
+    rng = random.Random(42)
+    conn.executemany(
+        "INSERT INTO posts (post_id, user_id, file_path, status, url, date_posted) VALUES (?, ?, ?, ?, ?, '')",
+        (
+            (
+                i,
+                ADMIN_ID if rng.random() < 0.05 else rng.randint(3, 5000),
+                f"storage/posts/posts_{i // 10000 + 1}.json:{i % 10000}",
+                'expired' if rng.random() < 0.1 else 'active',
+                f"https://opr.news/{i}",
+            )
+            for i in range(1, n_posts + 1)
+        ),
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO views (user_id, post_id, date_viewed) VALUES (?, ?, '')",
+        ((VIEWER_ID, rng.randint(1, n_posts)) for _ in range(1000)),
+    )
+    conn.executemany(
+        "INSERT INTO views (user_id, post_id, date_viewed) VALUES (?, ?, '')",
+        ((EXHAUSTED_VIEWER_ID, i) for i in range(1, n_posts + 1)),
+    )
+    conn.commit()
+    conn.close()
+
+
+async def legacy_sample(db, viewer_id):
+    # What message_handler's get_links closure used to do (minus the file reads)
+    async with db.execute("SELECT post_id FROM views WHERE user_id = ?", (viewer_id,)) as cursor:
+        viewed = {row[0] async for row in cursor}
+    picked = []
+    for sql, params, quota in (
+        ("SELECT post_id FROM posts WHERE user_id = ? AND status = 'active' ORDER BY RANDOM()", (ADMIN_ID,), 4),
+        ("SELECT post_id FROM posts WHERE user_id != ? AND status = 'active' ORDER BY RANDOM()", (viewer_id,), 6),
+    ):
+        found = 0
+        async with db.execute(sql, params) as cursor:
+            async for row in cursor:
+                if row[0] in viewed or row[0] in picked:
+                    continue
+                picked.append(row[0])
+                found += 1
+                if found >= quota:
+                    break
+    return picked
+
+
+async def probe_sample(db, viewer_id):
+    exclude = []
+    admin = await database._sample_rows(
+        db, [("status = 'active' AND user_id = ?", (ADMIN_ID,))], viewer_id, 4, exclude
+    )
+    users = await database._sample_rows(
+        db, [("+status = 'active' AND user_id != ? AND user_id NOT IN (?)", (viewer_id, ADMIN_ID))],
+        viewer_id, 6, exclude
+    )
+    return admin + users
+
+
+async def time_it(func, db, viewer_id):
+    times = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        await func(db, viewer_id)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times[len(times) // 2] * 1000, times[int(len(times) * 0.95) - 1] * 1000
+
+
+async def main(sizes):
+    print(f"{'posts':>9} | {'viewer':>9} | {'ORDER BY RANDOM() p50/p95 ms':>30} | {'rowid probing p50/p95 ms':>26}")
+    for n_posts in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'bench.db')
+            build_db(path, n_posts)
+            async with aiosqlite.connect(path) as db:
+                db.row_factory = aiosqlite.Row
+                for label, viewer_id in (('1k views', VIEWER_ID), ('exhausted', EXHAUSTED_VIEWER_ID)):
+                    legacy = await time_it(legacy_sample, db, viewer_id)
+                    probe = await time_it(probe_sample, db, viewer_id)
+                    print(f"{n_posts:>9} | {label:>9} | {legacy[0]:>14.2f} / {legacy[1]:<13.2f} | "
+                          f"{probe[0]:>11.2f} / {probe[1]:<12.2f}")
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    asyncio.run(main(sizes))
@@ -1,27 +1,35 @@
 import random
 from datetime import datetime, timedelta, timezone
-# In-memory store for summary password and expiry
-SUMMARY_PASSWORDS = {}
+from ttl_cache import TTLCache
+# In-memory store for summary password and expiry. Entries are kept for an hour after they
+# are issued so a late attempt is told the password expired, then dropped.
+SUMMARY_PASSWORD_LIFETIME = timedelta(minutes=10)
+SUMMARY_PASSWORDS = TTLCache(ttl=3600, max_size=1000)
 
 import logging
 import asyncio
 import os
-import time
-import io
-import re
 import json
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardMarkup, InlineKeyboardButton, LabeledPrice
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler, PreCheckoutQueryHandler
 )
 from database import (
-    init_db, add_user, get_user, set_user_role, add_view,
-    add_points, get_user_points, record_payment, get_user_viewed_post_ids, add_post
+    init_db, close_db, flush, reader, add_user, get_user, set_user_role, add_view,
+    add_points, get_user_points, record_payment, add_post,
+    sample_unviewed_posts, mark_user_unblocked
 )
-from file_storage import store_link_data
+from file_storage import store_link_data, close_writers
+from file_post_loader import shard_cache
 from payments import mock_buy5
-from PIL import Image
-import pytesseract
+from ocr_pool import ocr_pool, OCRBusy, OCR_BUSY_RETRIES, OCR_BUSY_RETRY_DELAY
+from ocr_preprocess import OCR_MODE_RAW, choose_photo
+from ocr_cache import verification_cache, perceptual_hash
+from extractors import extract_markers, is_opera_link, shorten_opera_link
+from sender import send_limiter, send_reply
+from update_processor import update_processor
+from persistence import persistence
+from media_assets import media_registry
 
 """ 
 bot.py 
@@ -42,7 +50,7 @@ async def summery_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     # Generate a random 6-digit password
     password = ''.join(random.choices('0123456789', k=6))
-    expires_at = datetime.now(timezone.utc) + timedelta(minutes=10)
+    expires_at = datetime.now(timezone.utc) + SUMMARY_PASSWORD_LIFETIME
     SUMMARY_PASSWORDS[user_id] = {'password': password, 'expires_at': expires_at}
     # Send password to admin
     admin_id = CONFIG.get('admin_user_id')
@@ -62,7 +70,6 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Single text message handler that handles the summary password flow and the main menu actions."""
     user = update.effective_user
     user_id = user.id
-    request_id = set_latest_request(context, user_id)
     text = update.message.text.strip() if update.message and update.message.text else ""
     main_keyboard = ReplyKeyboardMarkup([
         ["🔗 Post My Link", "💰 Gain Points", "👀 View My Points"],
@@ -99,19 +106,18 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             del SUMMARY_PASSWORDS[user_id]
             context.user_data.pop('awaiting_summary_password', None)
             # Gather and send summary
-            from database import DB_PATH
-            import aiosqlite
             now = datetime.now(timezone.utc)
             today = now.date().isoformat()
+            tomorrow = (now + timedelta(days=1)).date().isoformat()
             week_ago = (now - timedelta(days=7)).date().isoformat()
             month_ago = (now - timedelta(days=30)).date().isoformat()
             active_cutoff = (now - timedelta(minutes=10)).isoformat()
-            async with aiosqlite.connect(DB_PATH) as db:
-                db.row_factory = aiosqlite.Row
+            async with reader() as db:
                 total_users = await (await db.execute("SELECT COUNT(*) FROM users")).fetchone()
-                users_today = await (await db.execute("SELECT COUNT(*) FROM users WHERE date(date_joined)=?", (today,))).fetchone()
-                users_week = await (await db.execute("SELECT COUNT(*) FROM users WHERE date(date_joined)>=?", (week_ago,))).fetchone()
-                users_month = await (await db.execute("SELECT COUNT(*) FROM users WHERE date(date_joined)>=?", (month_ago,))).fetchone()
+                # Compare ISO strings directly (not date(date_joined)) so idx_users_date_joined is used
+                users_today = await (await db.execute("SELECT COUNT(*) FROM users WHERE date_joined>=? AND date_joined<?", (today, tomorrow))).fetchone()
+                users_week = await (await db.execute("SELECT COUNT(*) FROM users WHERE date_joined>=?", (week_ago,))).fetchone()
+                users_month = await (await db.execute("SELECT COUNT(*) FROM users WHERE date_joined>=?", (month_ago,))).fetchone()
                 total_links = await (await db.execute("SELECT COUNT(*) FROM posts")).fetchone()
                 active_users = await (await db.execute("SELECT COUNT(*) FROM users WHERE last_active>=?", (active_cutoff,))).fetchone()
             msg = (
@@ -131,16 +137,12 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
     # Not in summary mode: proceed with main menu actions
-    if not is_latest_request(context, user_id, request_id):
-        return
 
 
     # If user sends a valid Opera News link directly, only allow if they have started the post flow
-    import re, urllib.parse
-    opera_link_pattern = re.compile(r"https://(www\.)?(opr\.news|operanewsapp\.com)/")
-    if opera_link_pattern.match(text.strip()):
+    if is_opera_link(text):
         if not context.user_data.get('post_link_active'):
-            await try_send_reply(update.message.reply_text, "❌ Invalid request, please use the buttons.", reply_markup=main_keyboard)
+            await send_reply(update.message.reply_text, "❌ Invalid request, please use the buttons.", reply_markup=main_keyboard)
             return
         # Check admin status at the start of the post flow
         is_admin_user = is_admin(user.id)
@@ -162,11 +164,11 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         if not can_post:
             if is_admin_user:
-                await try_send_reply(update.message.reply_text, "❌ Admin error: please check your privileges.", reply_markup=main_keyboard)
+                await send_reply(update.message.reply_text, "❌ Admin error: please check your privileges.", reply_markup=main_keyboard)
             elif role in ('vip', 'free'):
-                await try_send_reply(update.message.reply_text, "❌ You need 1 point to post a link. View more news or buy points.", reply_markup=main_keyboard)
+                await send_reply(update.message.reply_text, "❌ You need 1 point to post a link. View more news or buy points.", reply_markup=main_keyboard)
             else:
-                await try_send_reply(update.message.reply_text, "❌ Unknown user role. Please contact admin.", reply_markup=main_keyboard)
+                await send_reply(update.message.reply_text, "❌ Unknown user role. Please contact admin.", reply_markup=main_keyboard)
             return
 
         # Passed all checks, now store the link
@@ -180,11 +182,11 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         json_file, post_idx = add_post_to_json(post_meta)
         # Store both the JSON file and the index in the DB
         file_ref = f"{json_file}:{post_idx}"
-        await add_post(user.id, file_ref, status='active')
+        await add_post(user.id, file_ref, status='active', url=url)
         # Only non-admins lose points
         if not is_admin_user:
             await add_points(user.id, -1)
-        await try_send_reply(update.message.reply_text, f"✅ Your link has been posted!\nShort link: {url}", reply_markup=main_keyboard)
+        await send_reply(update.message.reply_text, f"✅ Your link has been posted!\nShort link: {url}", reply_markup=main_keyboard)
         # Reset post flow flag
         context.user_data['post_link_active'] = False
         return
@@ -195,7 +197,7 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if text == "👀 View My Points":
         points = await get_user_points(user_id)
-        await try_send_reply(update.message.reply_text, f"🏅 You have accumulated {points:.1f} points from successful news viewing.", reply_markup=main_keyboard)
+        await send_reply(update.message.reply_text, f"🏅 You have accumulated {points:.1f} points from successful news viewing.", reply_markup=main_keyboard)
         return
     elif text == "💰 Gain Points":
         # Always generate a fresh list of unviewed links
@@ -207,67 +209,32 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             ["🔙 Back to Menu", "➡️ Continue"],
             ["🛒 Buy Post Points"]
         ], resize_keyboard=True)
-        from database import DB_PATH, get_user_viewed_post_ids
-        import aiosqlite, random
-        async def get_links():
-            import json
-            admin_id = CONFIG.get('admin_user_id')
-            admin_links = []
-            user_links = []
-            user_id_local = update.effective_user.id
-            viewed_post_ids = set(await get_user_viewed_post_ids(user_id_local))
-            from file_post_loader import load_post_from_ref
-            async with aiosqlite.connect(DB_PATH) as db:
-                db.row_factory = aiosqlite.Row
-                # Admin links (exclude links posted by the current user, even if admin)
-                async with db.execute("SELECT post_id, file_path, user_id FROM posts WHERE user_id = ? AND status = 'active' ORDER BY RANDOM()", (admin_id,)) as cursor:
-                    async for row in cursor:
-                        if row['post_id'] in viewed_post_ids:
-                            continue
-                        if str(row['user_id']) == str(user_id_local):
-                            continue
-                        link_data = load_post_from_ref(row['file_path'])
-                        admin_links.append({'url': link_data['url'], 'post_id': row['post_id']})
-                        if len(admin_links) >= 4:
-                            break
-                # User links (exclude posts by the current user)
-                async with db.execute("SELECT post_id, file_path, user_id FROM posts WHERE user_id != ? AND status = 'active' ORDER BY RANDOM()", (user_id_local,)) as cursor:
-                    async for row in cursor:
-                        if row['post_id'] in viewed_post_ids:
-                            continue
-                        if str(row['user_id']) == str(user_id_local):
-                            continue
-                        link_data = load_post_from_ref(row['file_path'])
-                        user_links.append({'url': link_data['url'], 'post_id': row['post_id']})
-                        if len(user_links) >= 6:
-                            break
-            all_links = admin_links + user_links
-            random.shuffle(all_links)
-            return all_links
-        news_links = await get_links()
+        news_links = await sample_unviewed_posts(
+            user_id, admin_quota=4, user_quota=6, admin_ids=CONFIG.get('admin_user_ids', [])
+        )
         # Store both url and post_id for each link
         context.user_data['news_links'] = news_links
         context.user_data['news_link_idx'] = 0
         context.user_data['pending_link'] = None
         context.user_data['pending_timer'] = None
         context.user_data['pending_min_time'] = None
-        await try_send_reply(update.message.reply_text, gain_points_msg, reply_markup=gain_points_keyboard)
+        await send_reply(update.message.reply_text, gain_points_msg, reply_markup=gain_points_keyboard)
         return
     elif text == "➡️ Continue":
         news_links = context.user_data.get('news_links', [])
         idx = context.user_data.get('news_link_idx', 0)
         if context.user_data.get('pending_link'):
-            await try_send_reply(update.message.reply_text, "⚠️ Please confirm you have viewed the previous link by pressing '✅ I’m Done' before continuing.")
+            await send_reply(update.message.reply_text, "⚠️ Please confirm you have viewed the previous link by pressing '✅ I’m Done' before continuing.")
             return
         if idx == 0:
             intro_msg = (
                 "🎉 Great! We will send you the links one at a time. Please view each news article.\n\n"
                 "Note: Make sure to stay on the news for at least a minute to help each other."
             )
-            await try_send_reply(update.message.reply_text, intro_msg)
+            await send_reply(update.message.reply_text, intro_msg)
         if idx < len(news_links):
             import random, time
-            processing_msg = await try_send_reply(update.message.reply_text, "⏳ Processing...")
+            processing_msg = await send_reply(update.message.reply_text, "⏳ Processing...")
             try:
                 if processing_msg:
                     await processing_msg.delete()
@@ -286,9 +253,9 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 [InlineKeyboardButton("✅ I’m Done", callback_data="confirm_done")]
             ])
             link_msg = f"📰 News Link {idx+1}: Please click the button below to open the news.\n\nAfter viewing, return and press '✅ I’m Done'.\n\nYou must stay at least 1 minute (randomized) to earn points!"
-            await try_send_reply(update.message.reply_text, link_msg, reply_markup=link_keyboard)
+            await send_reply(update.message.reply_text, link_msg, reply_markup=link_keyboard)
         else:
-            await try_send_reply(update.message.reply_text, "✅ You have completed all the news links! Thank you for helping each other.", reply_markup=main_keyboard)
+            await send_reply(update.message.reply_text, "✅ You have completed all the news links! Thank you for helping each other.", reply_markup=main_keyboard)
             context.user_data.pop('news_links', None)
             context.user_data.pop('news_link_idx', None)
             context.user_data.pop('pending_link', None)
@@ -299,7 +266,7 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif text == "🔗 Post My Link":
         # Set flag to allow link posting
         context.user_data['post_link_active'] = True
-        processing_msg = await try_send_reply(update.message.reply_text, "⏳ Processing...")
+        processing_msg = await send_reply(update.message.reply_text, "⏳ Processing...")
         instructions = (
             "📺 How to get your post link: Please watch this YouTube short!\n\n"
             "https://youtube.com/shorts/pbtNmCYezOc?si=gwRKa0uAxkLCu258\n\n"
@@ -320,50 +287,20 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     elif text == "🔙 Back to Menu":
         welcome_back_msg = "👋 Welcome back to the menu! How may we proceed?"
-        await try_send_reply(update.message.reply_text, welcome_back_msg, reply_markup=main_keyboard)
+        await send_reply(update.message.reply_text, welcome_back_msg, reply_markup=main_keyboard)
         return
     else:
         responses = {}
-        await try_send_reply(update.message.reply_text, responses.get(text, "❌ Unknown option"))
+        await send_reply(update.message.reply_text, responses.get(text, "❌ Unknown option"))
 
 
 
-async def try_send_reply(send_func, *args, **kwargs):
-    for attempt in range(10):
-        try:
-            return await send_func(*args, **kwargs)
-        except Exception:
-            if attempt == 9:
-                return None
-            await asyncio.sleep(1)
-
-# ---------- Utils for Request Tracking ----------
-def set_latest_request(context, user_id):
-    if not hasattr(context.application, "user_request_ids"):
-        context.application.user_request_ids = {}
-    request_id = str(time.time_ns())
-    context.application.user_request_ids[user_id] = request_id
-    return request_id
-
-def is_latest_request(context, user_id, request_id):
-    return context.application.user_request_ids.get(user_id) == request_id
-
-def shorten_opera_link(url):
-    """Convert long Opera News links to short format if possible."""
-    import urllib.parse
-    if 'operanewsapp.com' in url and 'news_entry_id=' in url:
-        parsed = urllib.parse.urlparse(url)
-        qs = urllib.parse.parse_qs(parsed.query)
-        news_entry_id = qs.get('news_entry_id', [None])[0]
-        if news_entry_id:
-            return f"https://opr.news/{news_entry_id}"
-    return url
-
 # ---------- Handlers ----------
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    request_id = set_latest_request(context, user_id)
     user_name = update.effective_user.first_name if update.effective_user else "there"
+    # A user who blocked the bot and came back gets broadcasts again
+    await mark_user_unblocked(user_id)
     # Set user role to admin if their Telegram ID matches admin_user_id in config
     admin_id = CONFIG.get('admin_user_id')
     # Do not add user to DB here; only after screenshot verification (except admin)
@@ -383,9 +320,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             InlineKeyboardButton("❌ Reject & Stop", callback_data="reject_rules")
         ]
     ])
-    if not is_latest_request(context, user_id, request_id):
-        return
-    await try_send_reply(
+    await send_reply(
         update.message.reply_text,
         welcome_message + "\n\nDo you agree to follow these rules and continue?",
         reply_markup=inline_keyboard
@@ -394,10 +329,6 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def rules_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    user_id = update.effective_user.id
-    request_id = set_latest_request(context, user_id)
-    if not is_latest_request(context, user_id, request_id):
-        return
     if query.data == "accept_rules":
         processing_msg = await query.message.reply_text("⏳ Processing...")
         instructions = (
@@ -416,14 +347,13 @@ async def rules_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except Exception:
             pass
     elif query.data == "reject_rules":
-        await try_send_reply(
+        await send_reply(
             query.message.reply_text,
             "👋 No worries! Thank you for checking out Panda Clicker. If you change your mind, you can always /start again. 🌟"
         )
 
 async def button_response(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    request_id = set_latest_request(context, user_id)
     text = update.message.text if update.message else ""
     main_keyboard = ReplyKeyboardMarkup([
         ["🔗 Post My Link", "💰 Gain Points", "👀 View My Points"],
@@ -444,12 +374,8 @@ async def button_response(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Cancelled. Returning to menu.", reply_markup=main_keyboard)
         return
 
-    if not is_latest_request(context, user_id, request_id):
-        return
     # If user sends a valid Opera News link directly, treat as post attempt
-    import re, urllib.parse
-    opera_link_pattern = re.compile(r"https://(www\.)?(opr\.news|operanewsapp\.com)/")
-    if opera_link_pattern.match(text.strip()):
+    if is_opera_link(text):
         user = update.effective_user
         user_data = await get_user(user.id)
         if not user_data:
@@ -470,9 +396,9 @@ async def button_response(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         if not can_post:
             if role in ('vip', 'free'):
-                await try_send_reply(update.message.reply_text, "❌ You need 1 posting credit to post a link. View more news to earn credits.", reply_markup=main_keyboard)
+                await send_reply(update.message.reply_text, "❌ You need 1 posting credit to post a link. View more news to earn credits.", reply_markup=main_keyboard)
             else:
-                await try_send_reply(update.message.reply_text, "❌ Unknown user role. Please contact admin.", reply_markup=main_keyboard)
+                await send_reply(update.message.reply_text, "❌ Unknown user role. Please contact admin.", reply_markup=main_keyboard)
             return
 
         # Passed all checks, now store the link
@@ -490,11 +416,11 @@ async def button_response(update: Update, context: ContextTypes.DEFAULT_TYPE):
             json.dump(post_meta, f)
         # Store only reference in DB: post_id, user_id, status
         from database import add_post
-        await add_post(user.id, meta_path, status='active')
+        await add_post(user.id, meta_path, status='active', url=url)
         # Only non-admins lose credits
         if role != 'admin':
             await add_points(user.id, -1)
-        await try_send_reply(update.message.reply_text, f"✅ Your link has been posted!\nShort link: {url}", reply_markup=main_keyboard)
+        await send_reply(update.message.reply_text, f"✅ Your link has been posted!\nShort link: {url}", reply_markup=main_keyboard)
         return
 
 
@@ -504,7 +430,7 @@ async def button_response(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if text == "👀 View My Points":
         points = await get_user_points(user_id)
-        await try_send_reply(update.message.reply_text, f"🏅 You have accumulated {points:.1f} points from successful news viewing.", reply_markup=main_keyboard)
+        await send_reply(update.message.reply_text, f"🏅 You have accumulated {points:.1f} points from successful news viewing.", reply_markup=main_keyboard)
         return
     elif text == "💰 Gain Points":
         gain_points_msg = (
@@ -516,62 +442,31 @@ async def button_response(update: Update, context: ContextTypes.DEFAULT_TYPE):
             ["🛒 Buy Post Points"]
         ], resize_keyboard=True)
         # Fetch 4 admin links and 6 random user links
-        from database import DB_PATH
-        import aiosqlite, random
-        async def get_links():
-            import json
-            admin_id = CONFIG.get('admin_user_id')
-            admin_links = []
-            user_links = []
-            user_id = update.effective_user.id
-            viewed_post_ids = set(await get_user_viewed_post_ids(user_id))
-            async with aiosqlite.connect(DB_PATH) as db:
-                db.row_factory = aiosqlite.Row
-                # Get 4 random admin posts the user hasn't viewed
-                async with db.execute("SELECT post_id, file_path FROM posts WHERE user_id = ? AND status = 'active' ORDER BY RANDOM()", (admin_id,)) as cursor:
-                    async for row in cursor:
-                        if row['post_id'] not in viewed_post_ids:
-                            with open(row['file_path'], 'r') as f:
-                                link_data = json.load(f)
-                                admin_links.append(link_data['url'])
-                        if len(admin_links) >= 4:
-                            break
-                # Get 6 random user posts (excluding admin) the user hasn't viewed
-                async with db.execute("SELECT post_id, file_path FROM posts WHERE user_id != ? AND status = 'active' ORDER BY RANDOM()", (admin_id,)) as cursor:
-                    async for row in cursor:
-                        if row['post_id'] not in viewed_post_ids:
-                            with open(row['file_path'], 'r') as f:
-                                link_data = json.load(f)
-                                user_links.append(link_data['url'])
-                        if len(user_links) >= 6:
-                            break
-            # Combine and shuffle all links
-            all_links = admin_links + user_links
-            random.shuffle(all_links)
-            return all_links
-        news_links = await get_links()
+        news_links = [link['url'] for link in await sample_unviewed_posts(
+            user_id, admin_quota=4, user_quota=6, admin_ids=CONFIG.get('admin_user_ids', [])
+        )]
         context.user_data['news_links'] = news_links
         context.user_data['news_link_idx'] = 0
         context.user_data['pending_link'] = None
         context.user_data['pending_timer'] = None
         context.user_data['pending_min_time'] = None
-        await try_send_reply(update.message.reply_text, gain_points_msg, reply_markup=gain_points_keyboard)
+        await send_reply(update.message.reply_text, gain_points_msg, reply_markup=gain_points_keyboard)
         return
     elif text == "➡️ Continue":
         news_links = context.user_data.get('news_links', [])
         idx = context.user_data.get('news_link_idx', 0)
         if context.user_data.get('pending_link'):
-            await try_send_reply(update.message.reply_text, "⚠️ Please confirm you have viewed the previous link by pressing '✅ I’m Done' before continuing.")
+            await send_reply(update.message.reply_text, "⚠️ Please confirm you have viewed the previous link by pressing '✅ I’m Done' before continuing.")
             return
         if idx == 0:
             intro_msg = (
                 "🎉 Great! We will send you the links one at a time. Please view each news article.\n\n"
                 "Note: Make sure to stay on the news for at least a minute to help each other."
             )
-            await try_send_reply(update.message.reply_text, intro_msg)
+            await send_reply(update.message.reply_text, intro_msg)
         if idx < len(news_links):
             import random, time
-            processing_msg = await try_send_reply(update.message.reply_text, "⏳ Processing...")
+            processing_msg = await send_reply(update.message.reply_text, "⏳ Processing...")
             try:
                 if processing_msg:
                     await processing_msg.delete()
@@ -589,9 +484,9 @@ async def button_response(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 [InlineKeyboardButton("✅ I’m Done", callback_data="confirm_done")]
             ])
             link_msg = f"📰 News Link {idx+1}: Please click the button below to open the news.\n\nAfter viewing, return and press '✅ I’m Done'.\n\nYou must stay at least 1 minute (randomized) to earn points!"
-            await try_send_reply(update.message.reply_text, link_msg, reply_markup=link_keyboard)
+            await send_reply(update.message.reply_text, link_msg, reply_markup=link_keyboard)
         else:
-            await try_send_reply(update.message.reply_text, "✅ You have completed all the news links! Thank you for helping each other.", reply_markup=main_keyboard)
+            await send_reply(update.message.reply_text, "✅ You have completed all the news links! Thank you for helping each other.", reply_markup=main_keyboard)
             context.user_data.pop('news_links', None)
             context.user_data.pop('news_link_idx', None)
             context.user_data.pop('pending_link', None)
@@ -599,7 +494,7 @@ async def button_response(update: Update, context: ContextTypes.DEFAULT_TYPE):
             context.user_data.pop('pending_min_time', None)
         return
     elif text == "🔗 Post My Link":
-        processing_msg = await try_send_reply(update.message.reply_text, "⏳ Processing...")
+        processing_msg = await send_reply(update.message.reply_text, "⏳ Processing...")
         video_path = "testing.mp4"
         caption = (
             "🎥 Here is a short video showing how to get your link and post it.\n\n"
@@ -609,8 +504,8 @@ async def button_response(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         back_keyboard = ReplyKeyboardMarkup([["🔙 Back to Menu"]], resize_keyboard=True)
         try:
-            await update.message.reply_video(
-                video=open(video_path, "rb"),
+            await media_registry.send(
+                update.message.reply_video, video_path, 'video',
                 caption=caption,
                 reply_markup=back_keyboard
             )
@@ -624,11 +519,11 @@ async def button_response(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     elif text == "🔙 Back to Menu":
         welcome_back_msg = "👋 Welcome back to the menu! How may we proceed?"
-        await try_send_reply(update.message.reply_text, welcome_back_msg, reply_markup=main_keyboard)
+        await send_reply(update.message.reply_text, welcome_back_msg, reply_markup=main_keyboard)
         return
     else:
         responses = {}
-        await try_send_reply(update.message.reply_text, responses.get(text, "❌ Unknown option"))
+        await send_reply(update.message.reply_text, responses.get(text, "❌ Unknown option"))
 
 from telegram import LabeledPrice
 from telegram.ext import PreCheckoutQueryHandler, MessageHandler, filters as ext_filters
@@ -677,7 +572,7 @@ async def precheckout_callback(update, context):
 
 async def successful_payment_callback(update, context):
     user_id = update.effective_user.id
-    from database import add_points, record_payment
+    from database import record_purchase
     payment = update.message.successful_payment
     # Determine how many points to add
     points = 1
@@ -686,41 +581,68 @@ async def successful_payment_callback(update, context):
             points = int(payment.invoice_payload.split("_")[-1])
         except Exception:
             points = 1
-    await add_points(user_id, points)
-    await record_payment(user_id, payment.total_amount, points)
+    # Payments bypass write-behind: points and payment row commit together, immediately
+    await record_purchase(user_id, payment.total_amount, points)
     await update.message.reply_text(f"✅ Payment successful! You received {points} Point{'s' if points > 1 else ''}.")
 
+async def read_verification_screenshot(photo_sizes, processing_msg, user_id):
+    """
+    Return the parsed verification fields for a screenshot, or None if OCR couldn't run.
+    Resent screenshots are answered from verification_cache: by file_unique_id before
+    downloading, then by the user's own earlier screenshots' perceptual hash before running OCR.
+    """
+    ocr_mode = CONFIG.get('ocr_mode', OCR_MODE_RAW)
+    photo = choose_photo(photo_sizes, ocr_mode)
+    result = verification_cache.get_by_file(photo.file_unique_id)
+    if result is not None:
+        return result
+    photo_file = await photo.get_file()
+    photo_bytes = bytes(await photo_file.download_as_bytearray())
+    try:
+        phash = perceptual_hash(photo_bytes)
+    except Exception as e:
+        logging.error(f"Could not hash screenshot from user {user_id}: {e}")
+        phash = None
+    if phash is not None:
+        result = verification_cache.get_by_hash(user_id, phash)
+        if result is not None:
+            verification_cache.put(user_id, photo.file_unique_id, phash, result)
+            return result
+    # OCR runs in the worker pool; when it's full, tell the user and retry a few times
+    extracted_text = None
+    for attempt in range(OCR_BUSY_RETRIES + 1):
+        try:
+            extracted_text = await ocr_pool.image_to_string(photo_bytes, mode=ocr_mode)
+            break
+        except OCRBusy:
+            if attempt == OCR_BUSY_RETRIES:
+                break
+            if attempt == 0:
+                await send_reply(processing_msg.edit_text, "⏳ Lots of screenshots right now, retrying in a moment...")
+            await asyncio.sleep(OCR_BUSY_RETRY_DELAY)
+        except Exception as e:
+            logging.error(f"OCR failed for user {user_id}: {e}")
+            break
+    if extracted_text is None:
+        return None
+    result = extract_markers(extracted_text)
+    if phash is not None:
+        verification_cache.put(user_id, photo.file_unique_id, phash, result)
+    return result
+
 async def screenshot_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    request_id = set_latest_request(context, user_id)
-    processing_msg = await try_send_reply(update.message.reply_text, "⏳ Processing...")
+    processing_msg = await send_reply(update.message.reply_text, "⏳ Processing...")
     if not update.message.photo:
-        await try_send_reply(processing_msg.edit_text, "❌ Please send a valid screenshot as a photo.")
+        await send_reply(processing_msg.edit_text, "❌ Please send a valid screenshot as a photo.")
         return
-    photo_file = await update.message.photo[-1].get_file()
-    photo_bytes = await photo_file.download_as_bytearray()
-    image = Image.open(io.BytesIO(photo_bytes))
-    extracted_text = pytesseract.image_to_string(image)
-    installation_id = None
-    version = None
-    signout = False
-    for line in extracted_text.splitlines():
-        if installation_id is None:
-            match = re.search(r"installation id\s*[:\-]?\s*([^\n]+)", line, re.IGNORECASE)
-            if match:
-                installation_id = match.group(1).strip()
-        if version is None:
-            match = re.search(r"version\s*[:\-]?\s*([^\n]+)", line, re.IGNORECASE)
-            if match:
-                version = match.group(1).strip()
-        if not signout and re.search(r"sign out", line, re.IGNORECASE):
-            signout = True
-    if not is_latest_request(context, user_id, request_id):
-        try:
-            await processing_msg.delete()
-        except Exception:
-            pass
+    result = await read_verification_screenshot(update.message.photo, processing_msg, user_id)
+    if result is None:
+        await send_reply(processing_msg.edit_text, "❌ We couldn't read your screenshot right now. Please send it again in a minute.")
         return
+    installation_id = result['installation_id']
+    version = result['version']
+    signout = result['signout']
     # We still check for installation_id, version, and signout, but do NOT save them to DB
     if installation_id and version and signout:
         # Add user to DB only after passing screenshot verification (set admin role if in config)
@@ -749,12 +671,12 @@ async def screenshot_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
             await processing_msg.delete()
         except Exception:
             pass
-        await try_send_reply(update.message.reply_text, welcome_msg, reply_markup=reply_markup)
+        await send_reply(update.message.reply_text, welcome_msg, reply_markup=reply_markup)
     else:
         error_msg = (
             "❌ Verification failed. Please follow the instructions and send the correct screenshot."
         )
-        await try_send_reply(processing_msg.edit_text, error_msg)
+        await send_reply(processing_msg.edit_text, error_msg)
 async def confirm_done_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     # Answer the callback immediately to avoid Telegram 'query is too old' errors
@@ -765,7 +687,7 @@ async def confirm_done_callback(update: Update, context: ContextTypes.DEFAULT_TY
     user_id = update.effective_user.id
     data = context.user_data
     if not data.get('pending_link'):
-        await try_send_reply(query.message.reply_text, "❌ No link is currently pending confirmation.")
+        await send_reply(query.message.reply_text, "❌ No link is currently pending confirmation.")
         return
     import time, random
     now = int(time.time())
@@ -782,8 +704,8 @@ async def confirm_done_callback(update: Update, context: ContextTypes.DEFAULT_TY
             [InlineKeyboardButton("✅ I’m Done", callback_data="confirm_done")]
         ])
         link_msg = f"📰 Please click the button below to open the news.\n\nAfter viewing, return and press '✅ I’m Done'.\n\nYou must stay at least some time (random) to earn points!"
-        await try_send_reply(query.message.reply_text, f"⏳ Too fast! You must wait at least {min_time} seconds. Please try again and wait longer.")
-        await try_send_reply(query.message.reply_text, link_msg, reply_markup=link_keyboard)
+        await send_reply(query.message.reply_text, f"⏳ Too fast! You must wait at least {min_time} seconds. Please try again and wait longer.")
+        await send_reply(query.message.reply_text, link_msg, reply_markup=link_keyboard)
         return
     # Grant points, record view, move to next link
     from database import add_points, add_view, get_user_viewed_post_ids
@@ -791,7 +713,7 @@ async def confirm_done_callback(update: Update, context: ContextTypes.DEFAULT_TY
     post_id = data.get('pending_post_id')
     if post_id:
         await add_view(user_id, post_id)
-    await try_send_reply(query.message.reply_text, "✅ Great! You have earned 0.1 points for this link.")
+    await send_reply(query.message.reply_text, "✅ Great! You have earned 0.1 points for this link.")
     # Advance to next unviewed link automatically
     data['news_link_idx'] = data.get('news_link_idx', 0) + 1
     data['pending_link'] = None
@@ -824,14 +746,14 @@ async def confirm_done_callback(update: Update, context: ContextTypes.DEFAULT_TY
             [InlineKeyboardButton("✅ I’m Done", callback_data="confirm_done")]
         ])
         link_msg = f"📰 News Link: Please click the button below to open the news.\n\nAfter viewing, return and press '✅ I’m Done'.\n\nYou must stay at least 1 minute (randomized) to earn points!"
-        await try_send_reply(query.message.reply_text, link_msg, reply_markup=link_keyboard)
+        await send_reply(query.message.reply_text, link_msg, reply_markup=link_keyboard)
         data['news_link_idx'] = next_idx
     else:
         main_keyboard = ReplyKeyboardMarkup([
             ["🔗 Post My Link", "💰 Gain Points", "👀 View My Points"],
             ["🛒 Buy Post Points"]
         ], resize_keyboard=True)
-        await try_send_reply(update.callback_query.message.reply_text, "✅ You have completed all the news links! Thank you for helping each other.", reply_markup=main_keyboard)
+        await send_reply(update.callback_query.message.reply_text, "✅ You have completed all the news links! Thank you for helping each other.", reply_markup=main_keyboard)
         context.user_data.pop('news_links', None)
         context.user_data.pop('news_link_idx', None)
     # Removed duplicate screenshot handler code from confirm_done_callback.
@@ -916,8 +838,58 @@ async def role(update: Update, context: ContextTypes.DEFAULT_TYPE):
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, PreCheckoutQueryHandler, filters
 from telegram import Update
 
+async def on_startup(application):
+    # Open the shared DB connection pool once for the lifetime of the bot
+    await init_db()
+
+async def on_shutdown(application):
+    # Commit any queued view/points writes before the pool goes away
+    await flush()
+    await close_db()
+    close_writers()
+    logging.info(f"OCR pool stats: {ocr_pool.stats()}, verification cache: {verification_cache.stats()}")
+    logging.info(f"Send stats: {send_limiter.stats()}, updates: {update_processor.stats()}")
+    logging.info(f"Summary passwords: {SUMMARY_PASSWORDS.stats()}, media: {media_registry.stats()}")
+    logging.info(f"Post shard cache: {shard_cache.stats()}")
+    ocr_pool.shutdown()
+
+def get_webhook_settings():
+    """Webhook server settings from the "webhook" section of config.json, overridden by WEBHOOK_* env vars."""
+    webhook = CONFIG.get("webhook", {})
+    settings = {
+        "listen": os.getenv("WEBHOOK_LISTEN", webhook.get("listen", "127.0.0.1")),
+        "port": int(os.getenv("WEBHOOK_PORT", webhook.get("port", 8443))),
+        "url_path": os.getenv("WEBHOOK_PATH", webhook.get("url_path", "telegram")).strip("/"),
+        # Public HTTPS URL Telegram posts to (the reverse proxy); registered on startup
+        "webhook_url": os.getenv("WEBHOOK_URL", webhook.get("url")) or None,
+        "secret_token": os.getenv("WEBHOOK_SECRET_TOKEN", webhook.get("secret_token")) or None,
+        "max_connections": int(os.getenv("WEBHOOK_MAX_CONNECTIONS", webhook.get("max_connections", 40))),
+    }
+    if not settings["webhook_url"]:
+        # PTB would otherwise register http://<listen>:<port>/<path>, which Telegram rejects
+        raise SystemExit(
+            "Webhook mode needs a public HTTPS URL: set webhook.url in config.json or WEBHOOK_URL"
+        )
+    if not settings["secret_token"]:
+        # Requests without the matching X-Telegram-Bot-Api-Secret-Token header are rejected
+        raise SystemExit(
+            "Webhook mode needs a secret token: set webhook.secret_token in config.json or WEBHOOK_SECRET_TOKEN"
+        )
+    return settings
+
 def main():
-    application = Application.builder().token(os.getenv("BOT_TOKEN_API")).build()
+    application = (
+        Application.builder()
+        .token(os.getenv("BOT_TOKEN_API"))
+        .rate_limiter(send_limiter)
+        # Users are handled in parallel; each user's updates still run in order
+        .concurrent_updates(update_processor)
+        # user_data survives restarts; stored in bot.db, loaded per user on demand
+        .persistence(persistence)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
     # register your handlers
     application.add_handler(CommandHandler("start", start))
@@ -934,8 +906,14 @@ def main():
     application.add_handler(PreCheckoutQueryHandler(precheckout_callback))
     application.add_handler(MessageHandler(filters.SUCCESSFUL_PAYMENT, successful_payment_callback))
 
-    print("🤖 Bot is running...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)  # ✅ no asyncio.run()
+    mode = os.getenv("BOT_MODE", CONFIG.get("mode", "polling"))
+    if mode == "webhook":
+        settings = get_webhook_settings()
+        print(f"🤖 Bot is running (webhook on {settings['listen']}:{settings['port']}/{settings['url_path']})...")
+        application.run_webhook(allowed_updates=Update.ALL_TYPES, **settings)
+    else:
+        print("🤖 Bot is running...")
+        application.run_polling(allowed_updates=Update.ALL_TYPES)  # ✅ no asyncio.run()
 # --- Add reset_timer_callback ---
 async def reset_timer_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
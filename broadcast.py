@@ -0,0 +1,158 @@
+"""
+broadcast.py
+Sends one message to every user: streams user IDs from the DB page by page, sends
+concurrently under a global token bucket, backs off on RetryAfter, drops users who
+blocked the bot, and checkpoints progress so an interrupted broadcast can resume.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+
+from sender import TokenBucket, retry_after_seconds
+from database import (
+    get_broadcast, get_user_id_page, mark_users_blocked, save_broadcast_progress, start_broadcast
+)
+
+# Telegram allows bots about 30 messages per second in total; stay a little under it
+BROADCAST_RATE = 25  # messages per second
+BROADCAST_BURST = 25
+# Sends in flight at once; the token bucket is what actually caps the rate
+BROADCAST_CONCURRENCY = 20
+# User IDs read from the DB per page; progress is checkpointed after every page
+BROADCAST_PAGE_SIZE = 500
+# Attempts per user for RetryAfter / network errors before counting it as failed
+BROADCAST_MAX_ATTEMPTS = 3
+# An unfinished broadcast with the same key is resumed only if it started this recently
+BROADCAST_RESUME_WINDOW = timedelta(hours=1)
+
+# BadRequest messages that mean the chat is gone for good
+_GONE_CHAT_ERRORS = ('chat not found', 'user not found', 'peer_id_invalid')
+
+
+class Broadcast:
+    """
+    One broadcast run. Counters: sent, failed, blocked (Forbidden or chat gone; these users
+    are flagged in the DB and skipped by later broadcasts until they /start the bot again or
+    are re-added, which clears the flag), retried (RetryAfter / network retries).
+    """
+
+    def __init__(self, bot, text, key, rate=BROADCAST_RATE, concurrency=BROADCAST_CONCURRENCY,
+                 page_size=BROADCAST_PAGE_SIZE, deadline=None):
+        self.bot = bot
+        self.text = text
+        self.key = key
+        self.bucket = TokenBucket(rate, min(rate, BROADCAST_BURST))
+        self.concurrency = concurrency
+        self.page_size = page_size
+        # Seconds this run may take; remaining users are left for a resumed run
+        self.deadline = deadline
+        self.last_user_id = 0
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+        self.retried = 0
+        self.resumed = False
+        self.completed = False
+
+    async def _load_progress(self, resume):
+        row = await get_broadcast(self.key) if resume else None
+        if row and row['finished_at'] is None and row['message'] == self.text:
+            started_at = datetime.fromisoformat(row['started_at'])
+            if datetime.utcnow() - started_at <= BROADCAST_RESUME_WINDOW:
+                self.last_user_id = row['last_user_id']
+                self.sent, self.failed, self.blocked = row['sent'], row['failed'], row['blocked']
+                self.resumed = True
+                return
+        await start_broadcast(self.key, self.text)
+
+    async def _send(self, user_id):
+        """Send to one user; returns 'sent', 'failed' or 'blocked'."""
+        for attempt in range(BROADCAST_MAX_ATTEMPTS):
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(user_id, self.text)
+                return 'sent'
+            except RetryAfter as e:
+                seconds = retry_after_seconds(e)
+                logging.warning(f"Broadcast {self.key}: flood limit hit, pausing {seconds:.0f}s")
+                self.bucket.pause(seconds)
+            except Forbidden:
+                return 'blocked'
+            except BadRequest as e:
+                if any(reason in str(e).lower() for reason in _GONE_CHAT_ERRORS):
+                    return 'blocked'
+                logging.warning(f"Broadcast {self.key}: send to {user_id} rejected: {e}")
+                return 'failed'
+            except (TimedOut, NetworkError) as e:
+                logging.debug(f"Broadcast {self.key}: send to {user_id} failed ({e}), retrying")
+                await asyncio.sleep(2 ** attempt)
+            except Exception as e:
+                logging.warning(f"Broadcast {self.key}: send to {user_id} failed: {e}")
+                return 'failed'
+            self.retried += 1
+        return 'failed'
+
+    async def _send_page(self, user_ids):
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def send_one(user_id):
+            async with slots:
+                return await self._send(user_id)
+
+        outcomes = await asyncio.gather(*(send_one(uid) for uid in user_ids))
+        blocked = [uid for uid, outcome in zip(user_ids, outcomes) if outcome == 'blocked']
+        self.sent += outcomes.count('sent')
+        self.failed += outcomes.count('failed')
+        self.blocked += len(blocked)
+        await mark_users_blocked(blocked)
+
+    async def run(self, resume=True):
+        """Send to every reachable user and return stats(); stops early if the deadline passes."""
+        await self._load_progress(resume)
+        start = time.monotonic()
+        sent_before = self.sent
+        while True:
+            limit = self.page_size
+            if self.deadline is not None:
+                remaining = self.deadline - (time.monotonic() - start)
+                if remaining <= 0:
+                    logging.warning(f"Broadcast {self.key}: deadline reached after user {self.last_user_id}")
+                    break
+                # Only take as many users as the bucket can serve before the deadline
+                limit = max(1, min(limit, int(remaining * self.bucket.rate)))
+            user_ids = await get_user_id_page(self.last_user_id, limit)
+            if not user_ids:
+                self.completed = True
+                break
+            await self._send_page(user_ids)
+            self.last_user_id = user_ids[-1]
+            await save_broadcast_progress(self.key, self.last_user_id, self.sent, self.failed, self.blocked)
+        await save_broadcast_progress(
+            self.key, self.last_user_id, self.sent, self.failed, self.blocked, finished=self.completed
+        )
+        elapsed = time.monotonic() - start
+        stats = self.stats()
+        stats['elapsed_s'] = round(elapsed, 2)
+        stats['per_second'] = round((self.sent - sent_before) / elapsed, 1) if elapsed > 0 else 0.0
+        logging.info(f"Broadcast {self.key} finished: {stats}")
+        return stats
+
+    def stats(self):
+        return {
+            'key': self.key,
+            'sent': self.sent,
+            'failed': self.failed,
+            'blocked': self.blocked,
+            'retried': self.retried,
+            'resumed': self.resumed,
+            'completed': self.completed,
+            'last_user_id': self.last_user_id,
+        }
+
+
+async def broadcast(bot, text, key, resume=True, **kwargs):
+    """Send `text` to every user; an unfinished run with the same key and text is resumed."""
+    return await Broadcast(bot, text, key, **kwargs).run(resume=resume)
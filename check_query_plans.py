@@ -0,0 +1,27 @@
+"""
+check_query_plans.py
+Print EXPLAIN QUERY PLAN for every hot query in database.HOT_QUERIES.
+Exits with status 1 if any of them does a full table scan.
+"""
+import asyncio
+import sys
+
+import aiosqlite
+
+from database import DB_PATH, explain_hot_queries
+
+
+async def main(db_path=DB_PATH):
+    async with aiosqlite.connect(db_path) as db:
+        report = await explain_hot_queries(db)
+    failed = False
+    for name, (plan, full_scan) in report.items():
+        print(f"{'FULL SCAN' if full_scan else 'ok':9} {name}")
+        for detail in plan:
+            print(f"          {detail}")
+        failed = failed or full_scan
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(*sys.argv[1:])))
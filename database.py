@@ -5,15 +5,381 @@ Handles migrations, queries, and user/link/payment logic.
 """
 import aiosqlite
 import asyncio
+import importlib.util
 import logging
+import os
+import random
+import re
+from contextlib import asynccontextmanager
 from datetime import datetime
 
 DB_PATH = 'bot.db'
 SCHEMA_PATH = 'schema.sql'
+MIGRATIONS_DIR = 'migrations'
+READ_POOL_SIZE = 4
+# Group commit: queued view/points writes are flushed together after this
+# many seconds or once this many operations are pending, whichever is first
+WRITE_BATCH_INTERVAL = 0.005
+WRITE_BATCH_SIZE = 64
+# Set to False to commit every queued write immediately (no write-behind)
+WRITE_BEHIND = True
+
+# Applied once to every pooled connection when it is opened
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=67108864",
+)
+
+
+class ConnectionPool:
+    """One long-lived writer connection plus a small pool of read connections.
+
+    Writes are serialized through a lock on the single writer; readers are
+    handed out from a queue and, thanks to WAL, never block on the writer.
+    """
+
+    def __init__(self, db_path=DB_PATH, readers=READ_POOL_SIZE):
+        self.db_path = db_path
+        self.size = readers
+        self.loop = None
+        self._writer = None
+        self._write_lock = None
+        self._readers = None
+        self._connections = []
+        self.queue = None
+
+    async def _connect(self):
+        db = await aiosqlite.connect(self.db_path)
+        db.row_factory = aiosqlite.Row
+        for pragma in CONNECTION_PRAGMAS:
+            await db.execute(pragma)
+        self._connections.append(db)
+        return db
+
+    async def open(self):
+        self.loop = asyncio.get_running_loop()
+        self._write_lock = asyncio.Lock()
+        self._readers = asyncio.Queue()
+        self._writer = await self._connect()
+        for _ in range(self.size):
+            db = await self._connect()
+            await db.execute("PRAGMA query_only=ON")
+            self._readers.put_nowait(db)
+        logging.info(f"Opened SQLite pool on {self.db_path} (1 writer, {self.size} readers)")
+
+    async def close(self):
+        for db in self._connections:
+            try:
+                await db.close()
+            except Exception as e:
+                logging.error(f"Error closing DB connection: {e}")
+        self._connections = []
+        self._writer = None
+        self._readers = None
+
+    @asynccontextmanager
+    async def writer(self):
+        async with self._write_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                # Never leave a half-done transaction on the shared connection, even when cancelled
+                await self._writer.rollback()
+                raise
+
+    @asynccontextmanager
+    async def reader(self):
+        db = await self._readers.get()
+        try:
+            yield db
+        finally:
+            self._readers.put_nowait(db)
+
+
+class WriteQueue:
+    """Write-behind queue that commits small mutations in one transaction.
+
+    Each operation is a list of (sql, params) statements applied atomically
+    inside its own savepoint, so one failing operation does not sink the
+    rest of the batch. Durable operations trigger an immediate flush with
+    synchronous=FULL and are awaited by the caller; the others return at
+    once and any error is logged.
+    """
+
+    def __init__(self, pool, interval=WRITE_BATCH_INTERVAL, max_ops=WRITE_BATCH_SIZE):
+        self.pool = pool
+        self.interval = interval
+        self.max_ops = max_ops
+        self.batches = 0
+        self.ops = 0
+        self._pending = []
+        self._wakeup = asyncio.Event()
+        # Held while a batch commits, so a flush() that finds the queue empty still waits
+        # for the batch another caller took out of it
+        self._flushing = asyncio.Lock()
+        self._stopping = False
+        self._task = None
+
+    def start(self):
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Let _run finish the flush it may be in (cancelling it would roll that batch back)
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def submit(self, statements, durable=False):
+        future = self.pool.loop.create_future() if durable else None
+        self._pending.append((statements, future))
+        if durable:
+            await self.flush()
+            await future
+        elif len(self._pending) == 1 or len(self._pending) >= self.max_ops:
+            self._wakeup.set()
+
+    async def _run(self):
+        while not self._stopping:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if self._stopping:
+                return
+            if len(self._pending) < self.max_ops:
+                await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Write-behind flush failed: {e}")
+
+    async def flush(self):
+        """Commit everything queued so far in a single transaction."""
+        async with self._flushing:
+            await self._flush()
+
+    async def _flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        durable = any(future is not None for _, future in batch)
+        errors = [None] * len(batch)
+        try:
+            async with self.pool.writer() as db:
+                if durable:
+                    await db.execute("PRAGMA synchronous=FULL")
+                await db.execute("BEGIN")
+                for i, (statements, _) in enumerate(batch):
+                    await db.execute("SAVEPOINT queued_op")
+                    try:
+                        for sql, params in statements:
+                            await db.execute(sql, params)
+                    except Exception as e:
+                        errors[i] = e
+                        await db.execute("ROLLBACK TO queued_op")
+                    await db.execute("RELEASE queued_op")
+                await db.commit()
+                if durable:
+                    await db.execute("PRAGMA synchronous=NORMAL")
+        except asyncio.CancelledError:
+            # Rolled back by pool.writer(); put the batch back so the next flush commits it
+            self._pending[:0] = batch
+            raise
+        except Exception as e:
+            errors = [e] * len(batch)
+        self.batches += 1
+        self.ops += len(batch)
+        for (statements, future), error in zip(batch, errors):
+            if future is None:
+                if error is not None:
+                    logging.error(f"Queued write failed ({statements[0][0].split()[0]}): {error}")
+            elif error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(None)
+
+
+_pool = None
+
+
+def _active_pool():
+    """Return the shared pool if it belongs to the running event loop."""
+    if _pool is None:
+        return None
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+    return _pool if _pool.loop is loop else None
+
+
+async def _queue_write(statements, durable=False):
+    """Apply statements through the write-behind queue, or directly if there is none."""
+    pool = _active_pool()
+    if pool is None or pool.queue is None:
+        async with writer() as db:
+            for sql, params in statements:
+                await db.execute(sql, params)
+            await db.commit()
+        return
+    await pool.queue.submit(statements, durable=durable or not WRITE_BEHIND)
+
+
+@asynccontextmanager
+async def _connect_once():
+    # Fallback for scripts and other event loops that never called init_db
+    async with aiosqlite.connect(DB_PATH) as db:
+        db.row_factory = aiosqlite.Row
+        yield db
+
+
+@asynccontextmanager
+async def writer():
+    """Shared writer connection (serialized). Callers must commit."""
+    pool = _active_pool()
+    if pool is None:
+        async with _connect_once() as db:
+            yield db
+        return
+    async with pool.writer() as db:
+        yield db
+
+
+@asynccontextmanager
+async def reader():
+    """Pooled read-only connection."""
+    pool = _active_pool()
+    if pool is None:
+        async with _connect_once() as db:
+            yield db
+        return
+    async with pool.reader() as db:
+        yield db
+
+
+def list_migrations(migrations_dir=MIGRATIONS_DIR):
+    """Return [(version, name, path)] for every NNN_name.sql / NNN_name.py file, in order."""
+    if not os.path.isdir(migrations_dir):
+        return []
+    migrations = []
+    for fname in os.listdir(migrations_dir):
+        match = re.match(r"^(\d+)_(\w+)\.(sql|py)$", fname)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(migrations_dir, fname)))
+    migrations.sort()
+    return migrations
+
+async def _run_python_migration(db, version, name, path):
+    # Python migrations define `async def upgrade(db)` for data fixes SQL alone can't do
+    spec = importlib.util.spec_from_file_location(f"migration_{version:03d}_{name}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    try:
+        await module.upgrade(db)
+        await db.execute(
+            "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+            (version, name, datetime.utcnow().isoformat())
+        )
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+
+async def run_migrations(db, migrations_dir=MIGRATIONS_DIR):
+    """Apply pending numbered migrations, each in its own transaction. Returns versions applied."""
+    await db.execute(
+        "CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, name TEXT, applied_at TEXT)"
+    )
+    await db.commit()
+    async with db.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version") as cursor:
+        current = (await cursor.fetchone())[0]
+    applied = []
+    for version, name, path in list_migrations(migrations_dir):
+        if version <= current:
+            continue
+        if path.endswith('.py'):
+            await _run_python_migration(db, version, name, path)
+        else:
+            with open(path, 'r') as f:
+                sql = f.read()
+            # executescript commits first, so wrap the file and its version row in one transaction
+            await db.executescript(
+                f"BEGIN;\n{sql}\n;"
+                f"INSERT INTO schema_version (version, name, applied_at) "
+                f"VALUES ({version}, '{name}', '{datetime.utcnow().isoformat()}');\nCOMMIT;"
+            )
+        logging.info(f"Applied migration {version:03d}_{name}")
+        applied.append(version)
+    return applied
+
+# Queries on the request path; each must be served by an index, not a full table scan
+HOT_QUERIES = {
+    "admin_active_posts": ("SELECT post_id, file_path, user_id FROM posts WHERE user_id = ? AND status = 'active'", (0,)),
+    "other_active_posts": ("SELECT post_id, file_path, user_id FROM posts WHERE user_id != ? AND status = 'active'", (0,)),
+    "viewed_post_ids": ("SELECT post_id FROM views WHERE user_id = ?", (0,)),
+    "sample_admin_post": (
+        "SELECT post_id, url FROM posts WHERE status = 'active' AND user_id = ? AND post_id >= ? "
+        "AND NOT EXISTS (SELECT 1 FROM views v WHERE v.user_id = ? AND v.post_id = posts.post_id) "
+        "AND url IS NOT NULL ORDER BY post_id LIMIT 1", (0, 0, 0)
+    ),
+    "sample_user_post": (
+        "SELECT post_id, url FROM posts WHERE +status = 'active' AND user_id != ? AND post_id >= ? "
+        "AND NOT EXISTS (SELECT 1 FROM views v WHERE v.user_id = ? AND v.post_id = posts.post_id) "
+        "AND url IS NOT NULL ORDER BY post_id LIMIT 1", (0, 0, 0)
+    ),
+    "user_by_id": ("SELECT * FROM users WHERE user_id = ?", (0,)),
+    "broadcast_user_page": (
+        "SELECT user_id FROM users WHERE user_id > ? AND blocked_at IS NULL ORDER BY user_id LIMIT ?", (0, 500)
+    ),
+    "users_joined_since": ("SELECT COUNT(*) FROM users WHERE date_joined >= ?", ('',)),
+    "users_joined_between": ("SELECT COUNT(*) FROM users WHERE date_joined >= ? AND date_joined < ?", ('', '')),
+    "users_active_since": ("SELECT COUNT(*) FROM users WHERE last_active >= ?", ('',)),
+}
+
+def _is_full_scan(detail):
+    # "SCAN posts" is a full scan; "SCAN posts USING INDEX ..." / "SEARCH ..." are not.
+    # A temp b-tree for ORDER BY means every matching row gets sorted, which is as bad.
+    if detail.startswith("USE TEMP B-TREE FOR ORDER BY"):
+        return True
+    return detail.startswith("SCAN ") and " USING " not in detail
+
+async def explain_hot_queries(db):
+    """Return {name: (plan_lines, full_scan)} from EXPLAIN QUERY PLAN for each hot query."""
+    report = {}
+    for name, (sql, params) in HOT_QUERIES.items():
+        async with db.execute(f"EXPLAIN QUERY PLAN {sql}", params) as cursor:
+            plan = [row[3] async for row in cursor]
+        report[name] = (plan, any(_is_full_scan(detail) for detail in plan))
+    return report
+
+async def check_query_plans(db):
+    """Log a warning for every hot query that regressed into a full scan. Returns their names."""
+    report = await explain_hot_queries(db)
+    scans = [name for name, (_, full_scan) in report.items() if full_scan]
+    for name in scans:
+        logging.warning(f"Hot query '{name}' does a full table scan: {' | '.join(report[name][0])}")
+    return scans
 
 async def init_db(db_path=DB_PATH, schema_path=SCHEMA_PATH):
-    """Initialize DB and run migrations."""
-    async with aiosqlite.connect(db_path) as db:
+    """Initialize DB, run migrations and open the shared connection pool."""
+    global _pool
+    if _pool is not None:
+        await close_db()
+    pool = ConnectionPool(db_path)
+    await pool.open()
+    pool.queue = WriteQueue(pool)
+    pool.queue.start()
+    _pool = pool
+    async with pool.writer() as db:
         # Run schema migrations
         with open(schema_path, 'r') as f:
             await db.executescript(f.read())
@@ -25,80 +391,282 @@ async def init_db(db_path=DB_PATH, schema_path=SCHEMA_PATH):
         if 'last_active' not in columns:
             await db.execute("ALTER TABLE users ADD COLUMN last_active TEXT")
         await db.commit()
+        await run_migrations(db)
+        await check_query_plans(db)
+
+async def flush():
+    """Commit any queued view/points writes now."""
+    pool = _active_pool()
+    if pool is not None and pool.queue is not None:
+        await pool.queue.flush()
+
+async def close_db():
+    """Flush queued writes and close the shared connection pool (call on shutdown)."""
+    global _pool
+    pool, _pool = _pool, None
+    if pool is not None:
+        if pool.queue is not None:
+            await pool.queue.stop()
+        await pool.close()
 
 async def add_user(user_id, username, installation_id=None, version=None, signout=None, role='free'):
     """Add or update a user."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with writer() as db:
         await db.execute(
             """
             INSERT INTO users (user_id, username, date_joined, role)
             VALUES (?, ?, ?, ?)
             ON CONFLICT(user_id) DO UPDATE SET
                 username=excluded.username,
-                role=excluded.role
+                role=excluded.role,
+                blocked_at=NULL
             """,
             (user_id, username, datetime.utcnow().isoformat(), role)
         )
         await db.commit()
 
 async def get_user(user_id):
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    async with reader() as db:
         async with db.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)) as cursor:
             return await cursor.fetchone()
 
 async def set_user_role(user_id, role):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with writer() as db:
         await db.execute("UPDATE users SET role = ? WHERE user_id = ?", (role, user_id))
         await db.commit()
 
 
 # All link data is now handled via posts table and file storage. See add_post and related logic below.
 
-async def add_view(user_id, post_id):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT INTO views (user_id, post_id, date_viewed) VALUES (?, ?, ?)",
-            (user_id, post_id, datetime.utcnow().isoformat())
-        )
-        await db.commit()
+async def add_view(user_id, post_id, durable=False):
+    await _queue_write([(
+        "INSERT INTO views (user_id, post_id, date_viewed) VALUES (?, ?, ?)",
+        (user_id, post_id, datetime.utcnow().isoformat())
+    )], durable)
 
 
 # Add 0.1 points for a successful view
-async def add_points(user_id, amount=0.1):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("UPDATE users SET points = points + ? WHERE user_id = ?", (amount, user_id))
-        await db.commit()
+async def add_points(user_id, amount=0.1, durable=False):
+    await _queue_write([
+        ("UPDATE users SET points = points + ? WHERE user_id = ?", (amount, user_id))
+    ], durable)
 
 async def get_user_points(user_id):
-    async with aiosqlite.connect(DB_PATH) as db:
+    # Queued add_points calls must be visible to the reader
+    await flush()
+    async with reader() as db:
         async with db.execute("SELECT points FROM users WHERE user_id = ?", (user_id,)) as cursor:
             row = await cursor.fetchone()
             return row[0] if row else 0
 
 
-async def record_payment(user_id, amount, points_bought):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
+async def record_payment(user_id, amount, points_bought, durable=True):
+    await _queue_write([(
+        "INSERT INTO payments (user_id, amount, posts_bought, date_paid) VALUES (?, ?, ?, ?)",
+        (user_id, amount, points_bought, datetime.utcnow().isoformat())
+    )], durable)
+
+async def record_purchase(user_id, amount, points_bought):
+    """Credit bought points and record the payment in one durable commit."""
+    await _queue_write([
+        ("UPDATE users SET points = points + ? WHERE user_id = ?", (points_bought, user_id)),
+        (
             "INSERT INTO payments (user_id, amount, posts_bought, date_paid) VALUES (?, ?, ?, ?)",
             (user_id, amount, points_bought, datetime.utcnow().isoformat())
-        )
-        await db.commit()
+        ),
+    ], durable=True)
 
 async def get_user_viewed_post_ids(user_id):
-    async with aiosqlite.connect(DB_PATH) as db:
+    # Queued add_view calls must be visible to the reader
+    await flush()
+    async with reader() as db:
         async with db.execute("SELECT post_id FROM views WHERE user_id = ?", (user_id,)) as cursor:
             return [row[0] async for row in cursor]
 
-async def add_post(user_id, file_ref, status="active"):
+async def _probe_unviewed(db, owner_clause, owner_params, viewer_id, start, exclude, end=None):
+    # First eligible post in [start, end) in post_id (rowid) order: an index seek, not a sort
+    excluded = f"AND post_id NOT IN ({','.join('?' * len(exclude))})" if exclude else ""
+    before_end = "AND post_id < ?" if end is not None else ""
+    async with db.execute(
+        f"""
+        SELECT post_id, url, user_id FROM posts
+        WHERE {owner_clause} AND post_id >= ? {before_end} {excluded} AND url IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM views v WHERE v.user_id = ? AND v.post_id = posts.post_id)
+        ORDER BY post_id LIMIT 1
+        """,
+        (*owner_params, start, *(() if end is None else (end,)), *exclude, viewer_id)
+    ) as cursor:
+        return await cursor.fetchone()
+
+async def _sample_rows(db, owners, viewer_id, quota, exclude):
+    """Randomly pick up to `quota` unviewed active posts matching any of `owners`.
+
+    owners is a list of (sql_clause, params) that also filter on status. Each pick probes a random post_id
+    in [min, max] and takes the next eligible row, wrapping to the start only as far as
+    the probe point, so the cost is a few index seeks per link instead of sorting every
+    post, and at most one pass over the range once nothing is left for an owner.
+    """
+    # Two subqueries: SQLite only uses the min/max shortcut for a lone aggregate
+    async with db.execute("SELECT (SELECT MIN(post_id) FROM posts), (SELECT MAX(post_id) FROM posts)") as cursor:
+        lo, hi = await cursor.fetchone()
+    if lo is None:
+        return []
+    owners = list(owners)
+    picked = []
+    while owners and len(picked) < quota:
+        clause, params = random.choice(owners)
+        start = random.randint(lo, hi)
+        row = await _probe_unviewed(db, clause, params, viewer_id, start, exclude)
+        if row is None and start > lo:
+            row = await _probe_unviewed(db, clause, params, viewer_id, lo, exclude, end=start)
+        if row is None:
+            # Nothing left for this owner
+            owners.remove((clause, params))
+            continue
+        picked.append(row)
+        exclude.append(row['post_id'])
+    return picked
+
+async def sample_unviewed_posts(user_id, admin_quota=4, user_quota=6, admin_ids=()):
+    """
+    Pick random active posts the user has not viewed and did not post:
+    up to admin_quota from admins and up to user_quota from everyone else.
+    Returns a shuffled list of {'url', 'post_id'} dicts.
+    """
+    admin_ids = [int(a) for a in admin_ids if int(a) != int(user_id)]
+    exclude = []
+    # Views still in the write queue would otherwise be offered again
+    await flush()
+    async with reader() as db:
+        admin_rows = await _sample_rows(
+            db, [("status = 'active' AND user_id = ?", (a,)) for a in admin_ids], user_id, admin_quota, exclude
+        )
+        not_admin = f"AND user_id NOT IN ({','.join('?' * len(admin_ids))})" if admin_ids else ""
+        # Unary + keeps the planner on the post_id range instead of the status index + a sort
+        user_rows = await _sample_rows(
+            db, [(f"+status = 'active' AND user_id != ? {not_admin}", (user_id, *admin_ids))], user_id, user_quota, exclude
+        )
+    links = [{'url': row['url'], 'post_id': row['post_id']} for row in admin_rows + user_rows]
+    random.shuffle(links)
+    return links
+
+async def add_post(user_id, file_ref, status="active", url=None):
     """
     Store a post reference in the DB. file_ref is in the format 'json_file:index'.
+    The url is kept inline so link selection never has to open file_ref.
     """
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with writer() as db:
+        await db.execute(
+            "INSERT INTO posts (user_id, file_path, status, date_posted, url) VALUES (?, ?, ?, ?, ?)",
+            (user_id, file_ref, status, datetime.utcnow().isoformat(), url)
+        )
+        await db.commit()
+
+async def get_user_id_page(after_user_id=0, limit=500):
+    """Next page of reachable user IDs in ID order (keyset pagination, no OFFSET scans)."""
+    async with reader() as db:
+        async with db.execute(
+            "SELECT user_id FROM users WHERE user_id > ? AND blocked_at IS NULL ORDER BY user_id LIMIT ?",
+            (after_user_id, limit)
+        ) as cursor:
+            return [row[0] async for row in cursor]
+
+async def mark_users_blocked(user_ids):
+    """Flag users who blocked the bot so broadcasts skip them."""
+    if not user_ids:
+        return
+    now = datetime.utcnow().isoformat()
+    async with writer() as db:
+        await db.executemany(
+            "UPDATE users SET blocked_at = ? WHERE user_id = ?", [(now, uid) for uid in user_ids]
+        )
+        await db.commit()
+
+async def mark_user_unblocked(user_id):
+    """A flagged user wrote to the bot again (e.g. /start after unblocking): include them in broadcasts."""
+    await _queue_write([
+        ("UPDATE users SET blocked_at = NULL WHERE user_id = ? AND blocked_at IS NOT NULL", (user_id,))
+    ])
+
+async def get_broadcast(broadcast_key):
+    async with reader() as db:
+        async with db.execute("SELECT * FROM broadcasts WHERE broadcast_key = ?", (broadcast_key,)) as cursor:
+            return await cursor.fetchone()
+
+async def start_broadcast(broadcast_key, message):
+    """Create (or restart from scratch) the progress row for a broadcast."""
+    now = datetime.utcnow().isoformat()
+    async with writer() as db:
+        await db.execute(
+            """
+            INSERT INTO broadcasts (broadcast_key, message, last_user_id, sent, failed, blocked, started_at, updated_at, finished_at)
+            VALUES (?, ?, 0, 0, 0, 0, ?, ?, NULL)
+            ON CONFLICT(broadcast_key) DO UPDATE SET
+                message=excluded.message, last_user_id=0, sent=0, failed=0, blocked=0,
+                started_at=excluded.started_at, updated_at=excluded.updated_at, finished_at=NULL
+            """,
+            (broadcast_key, message, now, now)
+        )
+        await db.commit()
+
+async def save_broadcast_progress(broadcast_key, last_user_id, sent, failed, blocked, finished=False):
+    now = datetime.utcnow().isoformat()
+    async with writer() as db:
+        await db.execute(
+            """
+            UPDATE broadcasts SET last_user_id = ?, sent = ?, failed = ?, blocked = ?, updated_at = ?,
+                finished_at = CASE WHEN ? THEN ? ELSE finished_at END
+            WHERE broadcast_key = ?
+            """,
+            (last_user_id, sent, failed, blocked, now, finished, now, broadcast_key)
+        )
+        await db.commit()
+
+# Session data for persistence.SQLitePersistence: one JSON document per user or chat
+_SESSION_TABLES = {'user_data': 'user_id', 'chat_data': 'chat_id'}
+
+async def load_session_data(table, key):
+    """Stored JSON text for one user ('user_data') or chat ('chat_data'), or None."""
+    column = _SESSION_TABLES[table]
+    async with reader() as db:
+        async with db.execute(f"SELECT data FROM {table} WHERE {column} = ?", (key,)) as cursor:
+            row = await cursor.fetchone()
+    return row[0] if row else None
+
+async def save_session_data(table, key, data):
+    column = _SESSION_TABLES[table]
+    await _queue_write([(
+        f"INSERT INTO {table} ({column}, data, updated_at) VALUES (?, ?, ?) "
+        f"ON CONFLICT({column}) DO UPDATE SET data=excluded.data, updated_at=excluded.updated_at",
+        (key, data, datetime.utcnow().isoformat())
+    )])
+
+async def delete_session_data(table, key):
+    column = _SESSION_TABLES[table]
+    await _queue_write([(f"DELETE FROM {table} WHERE {column} = ?", (key,))])
+
+async def get_media_file_id(content_hash):
+    async with reader() as db:
+        async with db.execute("SELECT file_id FROM media_assets WHERE content_hash = ?", (content_hash,)) as cursor:
+            row = await cursor.fetchone()
+    return row[0] if row else None
+
+async def save_media_file_id(content_hash, kind, file_id, file_unique_id=None, path=None):
+    async with writer() as db:
         await db.execute(
-            "INSERT INTO posts (user_id, file_path, status, date_posted) VALUES (?, ?, ?, ?)",
-            (user_id, file_ref, status, datetime.utcnow().isoformat())
+            """
+            INSERT INTO media_assets (content_hash, kind, file_id, file_unique_id, path, uploaded_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(content_hash) DO UPDATE SET kind=excluded.kind, file_id=excluded.file_id,
+                file_unique_id=excluded.file_unique_id, path=excluded.path, uploaded_at=excluded.uploaded_at
+            """,
+            (content_hash, kind, file_id, file_unique_id, path, datetime.utcnow().isoformat())
         )
         await db.commit()
 
+async def delete_media_file_id(content_hash):
+    async with writer() as db:
+        await db.execute("DELETE FROM media_assets WHERE content_hash = ?", (content_hash,))
+        await db.commit()
+
 # Add more queries as needed for your bot logic
@@ -0,0 +1,58 @@
+"""
+extractors.py
+Precompiled text extractors shared by the handlers: verification markers in OCR text
+and Opera News link detection / shortening.
+"""
+import re
+import urllib.parse
+
+# Everything str.splitlines() treats as a line break (Tesseract ends pages with \f)
+_EOL = r"\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029"
+# One alternation for all three markers so the OCR text is scanned once. Spaces and values
+# never cross a line break, and values are captured in lookaheads so a marker inside another
+# marker's value (e.g. "Version 1.2 Sign out") is still found, as with per-line searching.
+MARKERS_RE = re.compile(
+    rf"installation id[^\S{_EOL}]*[:\-]?[^\S{_EOL}]*(?=(?P<installation_id>[^{_EOL}]+))"
+    rf"|version[^\S{_EOL}]*[:\-]?[^\S{_EOL}]*(?=(?P<version>[^{_EOL}]+))"
+    r"|(?P<signout>sign out)",
+    re.IGNORECASE,
+)
+OPERA_LINK_RE = re.compile(r"https://(www\.)?(opr\.news|operanewsapp\.com)/")
+NEWS_ENTRY_ID_RE = re.compile(r"[?&]news_entry_id=([^&#]*)")
+
+
+def extract_markers(text):
+    """Return {'installation_id', 'version', 'signout'} from OCR text; first match of each wins."""
+    installation_id = None
+    version = None
+    signout = False
+    for match in MARKERS_RE.finditer(text):
+        if match.group('signout'):
+            signout = True
+        elif match.group('installation_id') is not None:
+            if installation_id is None:
+                installation_id = match.group('installation_id').strip()
+        elif match.group('version') is not None:
+            if version is None:
+                version = match.group('version').strip()
+        if installation_id is not None and version is not None and signout:
+            break
+    return {'installation_id': installation_id, 'version': version, 'signout': signout}
+
+
+def has_all_markers(text):
+    result = extract_markers(text)
+    return bool(result['installation_id'] and result['version'] and result['signout'])
+
+
+def is_opera_link(text):
+    return OPERA_LINK_RE.match(text.strip()) is not None
+
+
+def shorten_opera_link(url):
+    """Convert long Opera News links to short format if possible."""
+    if 'operanewsapp.com' in url:
+        match = NEWS_ENTRY_ID_RE.search(url)
+        if match and match.group(1):
+            return f"https://opr.news/{urllib.parse.unquote_plus(match.group(1))}"
+    return url
@@ -1,15 +1,127 @@
 import os
 import json
+import sys
+from array import array
+from collections import OrderedDict
 
-def load_post_from_ref(file_ref):
+from file_post_storage import POSTS_DIR, SEGMENT_EXT, OFFSET, index_path
+
+# Parsed legacy shards can hold 10,000 posts each, so keep only a handful
+SHARD_CACHE_SIZE = 8
+
+
+class ShardCache:
     """
-    Given a file reference in the format 'json_file:index', load and return the post dict.
+    Bounded LRU of parsed shard data keyed by path. An entry is reused only while
+    the file's mtime and size are unchanged, so appends and rewrites invalidate it.
     """
+
+    def __init__(self, max_entries=SHARD_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def get(self, path, loader):
+        st = os.stat(path)
+        version = (st.st_mtime_ns, st.st_size)
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] == version:
+            self._entries.move_to_end(path)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        value = loader(path)
+        self._entries[path] = (version, value)
+        self._entries.move_to_end(path)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return value
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+shard_cache = ShardCache()
+
+
+def _load_json_shard(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _load_offsets(idx_path):
+    with open(idx_path, 'rb') as f:
+        data = f.read()
+    offsets = array('Q')
+    offsets.frombytes(data[:len(data) - len(data) % OFFSET.size])
+    if sys.byteorder != 'little':
+        offsets.byteswap()
+    return offsets
+
+
+def _parse_ref(file_ref):
+    """Return (path, index); index is None for a legacy per-post '<uuid>.json' file."""
     if ':' not in file_ref:
+        if file_ref.endswith('.json') and os.path.exists(file_ref):
+            return file_ref, None
         raise ValueError('Invalid file reference format')
     json_file, idx = file_ref.rsplit(':', 1)
-    idx = int(idx)
-    json_path = os.path.join('storage', 'posts', os.path.basename(json_file))
-    with open(json_path, 'r', encoding='utf-8') as f:
-        posts = json.load(f)
-    return posts[idx]
+    return os.path.join(POSTS_DIR, os.path.basename(json_file)), int(idx)
+
+
+def _load_from_file(path, indices):
+    """Load the given record indices from one segment or shard, parsing it at most once."""
+    if path.endswith(SEGMENT_EXT):
+        offsets = shard_cache.get(index_path(path), _load_offsets)
+        posts = {}
+        with open(path, 'rb') as f:
+            for idx in indices:
+                if idx >= len(offsets):
+                    raise IndexError(f'Record {idx} not in {path}')
+                f.seek(offsets[idx])
+                posts[idx] = json.loads(f.readline())
+        return posts
+    shard = shard_cache.get(path, _load_json_shard)
+    return {idx: shard[idx] for idx in indices}
+
+
+def load_posts_from_refs(file_refs):
+    """
+    Load many posts at once, grouping refs by file so each shard or segment index is
+    parsed at most once. Returns the post dicts in the same order as file_refs.
+    """
+    parsed = [_parse_ref(ref) for ref in file_refs]
+    by_file = OrderedDict()
+    for path, idx in parsed:
+        if idx is not None:
+            by_file.setdefault(path, []).append(idx)
+    loaded = {path: _load_from_file(path, indices) for path, indices in by_file.items()}
+    posts = []
+    for path, idx in parsed:
+        if idx is None:
+            with open(path, 'r', encoding='utf-8') as f:
+                posts.append(json.load(f))
+        else:
+            posts.append(loaded[path][idx])
+    return posts
+
+
+def load_post_from_ref(file_ref):
+    """
+    Given a file reference in the format 'json_file:index', load and return the post dict.
+    'posts_N.jsonl:index' refs seek straight to the record; 'posts_N.json:index' refs load the
+    legacy shard. Legacy references that point straight at a per-post '<uuid>.json' file are also accepted.
+    """
+    return load_posts_from_refs([file_ref])[0]
@@ -1,37 +1,72 @@
+"""
+file_post_storage.py
+Append-only post segments: storage/posts/posts_N.jsonl holds one JSON post per
+line and posts_N.idx holds each record's byte offset as a little-endian uint64,
+so record i is read with two seeks. Legacy posts_N.json shards are read-only.
+"""
 import os
 import json
+import struct
 from datetime import datetime, timezone
 
 POSTS_DIR = os.path.join('storage', 'posts')
 POSTS_PER_FILE = 10000
+SEGMENT_EXT = '.jsonl'
+INDEX_EXT = '.idx'
+OFFSET = struct.Struct('<Q')
 
 
-def get_latest_posts_file():
+def _segment_number(fname):
+    return int(fname.split('_')[1].split('.')[0])
+
+
+def index_path(segment_path):
+    return segment_path[:-len(SEGMENT_EXT)] + INDEX_EXT
+
+
+def get_latest_segment():
     os.makedirs(POSTS_DIR, exist_ok=True)
-    files = [f for f in os.listdir(POSTS_DIR) if f.startswith('posts_') and f.endswith('.json')]
+    files = [f for f in os.listdir(POSTS_DIR) if f.startswith('posts_') and f.endswith(SEGMENT_EXT)]
     if not files:
-        return os.path.join(POSTS_DIR, 'posts_1.json')
-    files.sort(key=lambda x: int(x.split('_')[1].split('.')[0]))
+        return os.path.join(POSTS_DIR, f'posts_1{SEGMENT_EXT}')
+    files.sort(key=_segment_number)
     return os.path.join(POSTS_DIR, files[-1])
 
 
+def _record_count(segment_path):
+    """Number of indexed records; drops a torn trailing index entry if the last write died."""
+    idx_path = index_path(segment_path)
+    if not os.path.exists(idx_path):
+        return 0
+    size = os.path.getsize(idx_path)
+    if size % OFFSET.size:
+        with open(idx_path, 'r+b') as f:
+            f.truncate(size - size % OFFSET.size)
+    return size // OFFSET.size
+
+
+def _fsync(path):
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            os.fsync(f.fileno())
+
+
 def add_post_to_json(post_meta):
-    """Add a post to the latest posts JSON file, rolling over if needed."""
-    latest_file = get_latest_posts_file()
-    if not os.path.exists(latest_file):
-        posts = []
-    else:
-        with open(latest_file, 'r', encoding='utf-8') as f:
-            try:
-                posts = json.load(f)
-            except Exception:
-                posts = []
-    if len(posts) >= POSTS_PER_FILE:
-        # Roll over to new file
-        idx = int(os.path.basename(latest_file).split('_')[1].split('.')[0]) + 1
-        latest_file = os.path.join(POSTS_DIR, f'posts_{idx}.json')
-        posts = []
-    posts.append(post_meta)
-    with open(latest_file, 'w', encoding='utf-8') as f:
-        json.dump(posts, f)
-    return latest_file, len(posts) - 1  # file path, index
+    """Append a post to the latest segment, rolling over if needed. Returns (segment path, index)."""
+    segment = get_latest_segment()
+    count = _record_count(segment)
+    if count >= POSTS_PER_FILE:
+        # Make the full segment durable before moving on to a new one
+        _fsync(segment)
+        _fsync(index_path(segment))
+        segment = os.path.join(POSTS_DIR, f'posts_{_segment_number(os.path.basename(segment)) + 1}{SEGMENT_EXT}')
+        count = 0
+    line = (json.dumps(post_meta) + '\n').encode('utf-8')
+    with open(segment, 'ab') as f:
+        offset = f.tell()
+        f.write(line)
+    # Index entry goes last: a crash before this leaves an unindexed tail, never a bad ref
+    with open(index_path(segment), 'ab') as f:
+        f.write(OFFSET.pack(offset))
+    return segment, count
+
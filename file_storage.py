@@ -5,6 +5,7 @@ Rotating JSONL file storage for heavy link data and OCR text.
 import os
 import json
 import logging
+import threading
 from typing import Dict, Any
 
 from datetime import datetime
@@ -32,27 +33,76 @@ def _get_next_file_index(folder: str, prefix: str) -> int:
     nums = [int(f[len(prefix)+1:-6]) for f in files if f[len(prefix)] == '_' and f[-6:] == '.jsonl']
     return max(nums, default=1)
 
-def _get_current_file(folder: str, prefix: str) -> str:
-    idx = _get_next_file_index(folder, prefix)
-    path = os.path.join(folder, f"{prefix}_{idx}.jsonl")
-    if not os.path.exists(path):
-        return path
-    # Check if file is full
-    with open(path, 'r', encoding='utf-8') as f:
-        lines = sum(1 for _ in f)
-    if lines >= get_jsonl_max_entries():
-        idx += 1
-        path = os.path.join(folder, f"{prefix}_{idx}.jsonl")
-    return path
+class SegmentWriter:
+    """
+    Appends JSONL entries for one prefix. The active segment and its entry count
+    are discovered once; after that each write is an append on an open handle and
+    rotation is O(1). A lock keeps writes whole when called from worker threads.
+    """
+
+    def __init__(self, folder: str, prefix: str):
+        self.folder = folder
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        self.index = _get_next_file_index(folder, prefix)
+        self.count = 0
+        path = self.path
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.count = sum(1 for _ in f)
+        self._file = None
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.folder, f"{self.prefix}_{self.index}.jsonl")
+
+    def write(self, data: Dict[str, Any]) -> str:
+        line = jsonlib.dumps(data) + '\n'
+        with self._lock:
+            if self.count >= get_jsonl_max_entries():
+                self._close_file()
+                self.index += 1
+                self.count = 0
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(line)
+            self._file.flush()
+            self.count += 1
+            return self.path
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        with self._lock:
+            self._close_file()
+
+
+_writers: Dict[tuple, SegmentWriter] = {}
+_writers_lock = threading.Lock()
+
+def get_writer(prefix: str) -> SegmentWriter:
+    folder = get_storage_folder()
+    key = (folder, prefix)
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None:
+            writer = _writers[key] = SegmentWriter(folder, prefix)
+    return writer
+
+def close_writers():
+    """Close all open segment handles (call on shutdown)."""
+    with _writers_lock:
+        for writer in _writers.values():
+            writer.close()
+        _writers.clear()
 
 def store_entry(prefix: str, data: Dict[str, Any]) -> str:
     """Store a dict as a JSONL entry, rotating files as needed. Returns file path."""
-    folder = get_storage_folder()
-    os.makedirs(folder, exist_ok=True)
-    path = _get_current_file(folder, prefix)
-    with open(path, 'a', encoding='utf-8') as f:
-        f.write(jsonlib.dumps(data) + '\n')
-    return path
+    return get_writer(prefix).write(data)
 
 def store_link_data(link_id: int, ocr_text: str, metadata: Dict[str, Any]) -> str:
     """Store heavy link data and OCR text, return file path and line number."""
@@ -0,0 +1,36 @@
+"""
+keyed_locks.py
+Per-key asyncio locks, shared by the update dispatcher (one lock per user) and the media
+registry (one upload per file at a time).
+"""
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class KeyedLocks:
+    """One asyncio.Lock per key, created on first use and dropped when nobody holds or waits for it."""
+
+    def __init__(self):
+        # key -> [lock, holders + waiters]
+        self._locks = {}
+
+    @asynccontextmanager
+    async def hold(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # asyncio.Lock wakes waiters first-in first-out, which keeps arrival order
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def __len__(self):
+        return len(self._locks)
+
+    def waiting(self):
+        return sum(max(0, count - 1) for _, count in self._locks.values())
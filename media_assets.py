@@ -0,0 +1,117 @@
+"""
+media_assets.py
+Registry for the static media the bot sends (tutorial videos etc.). Each file is uploaded
+once; the file_id Telegram returns is stored in bot.db under the file's content hash and
+reused for later sends. A rejected file_id (e.g. after a bot token change) triggers one re-upload.
+"""
+import hashlib
+import logging
+import os
+
+from telegram.error import BadRequest
+
+from database import delete_media_file_id, get_media_file_id, save_media_file_id
+from keyed_locks import KeyedLocks
+
+MEDIA_KINDS = ('photo', 'video', 'animation', 'document', 'audio', 'voice')
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MediaRegistry:
+    """
+    send(send_func, path, kind, **kwargs) calls e.g. message.reply_video with a cached file_id
+    when there is one, otherwise uploads the file and records the id. Hashes are cached per
+    (path, mtime_ns, size), so a file is re-read only when it changes on disk.
+    """
+
+    def __init__(self):
+        self.cached_sends = 0
+        self.uploads = 0
+        self.rejected_ids = 0
+        # path -> ((mtime_ns, size), sha256); content hash -> file_id
+        self._hashes = {}
+        self._file_ids = {}
+        # One upload per asset at a time, so concurrent first sends don't all upload;
+        # sends with a known file_id don't take the lock
+        self._uploading = KeyedLocks()
+
+    def content_hash(self, path):
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self._hashes.get(path)
+        if cached is None or cached[0] != signature:
+            cached = self._hashes[path] = (signature, _file_sha256(path))
+        return cached[1]
+
+    async def _file_id(self, content_hash):
+        file_id = self._file_ids.get(content_hash)
+        if file_id is None:
+            file_id = await get_media_file_id(content_hash)
+            if file_id is not None:
+                self._file_ids[content_hash] = file_id
+        return file_id
+
+    async def _forget(self, content_hash):
+        self._file_ids.pop(content_hash, None)
+        await delete_media_file_id(content_hash)
+
+    async def _send_cached(self, send_func, path, kind, content_hash, kwargs):
+        """Send by file_id if one is known; returns None when there is none or it was rejected."""
+        file_id = await self._file_id(content_hash)
+        if file_id is None:
+            return None
+        try:
+            message = await send_func(**{kind: file_id}, **kwargs)
+        except BadRequest as e:
+            # file_ids are per bot; a new token or an expired id means uploading again
+            logging.warning(f"Cached file_id for {path} rejected ({e}), re-uploading")
+            self.rejected_ids += 1
+            if self._file_ids.get(content_hash) == file_id:
+                await self._forget(content_hash)
+            return None
+        self.cached_sends += 1
+        return message
+
+    async def send(self, send_func, path, kind, **kwargs):
+        """Send a static media file; returns the sent Message."""
+        if kind not in MEDIA_KINDS:
+            raise ValueError(f"Unsupported media kind: {kind}")
+        content_hash = self.content_hash(path)
+        message = await self._send_cached(send_func, path, kind, content_hash, kwargs)
+        if message is not None:
+            return message
+        async with self._uploading.hold(content_hash):
+            # Another send may have uploaded it while we waited
+            if content_hash in self._file_ids:
+                message = await self._send_cached(send_func, path, kind, content_hash, kwargs)
+                if message is not None:
+                    return message
+            with open(path, 'rb') as f:
+                message = await send_func(**{kind: f}, **kwargs)
+            self.uploads += 1
+            media = getattr(message, kind, None)
+            if isinstance(media, (list, tuple)):
+                # Photos come back as a list of sizes; the largest is the original
+                media = media[-1] if media else None
+            if media is not None:
+                self._file_ids[content_hash] = media.file_id
+                await save_media_file_id(content_hash, kind, media.file_id, media.file_unique_id, path)
+            return message
+
+    def stats(self):
+        return {
+            'cached_sends': self.cached_sends,
+            'uploads': self.uploads,
+            'rejected_ids': self.rejected_ids,
+            'assets': len(self._file_ids),
+        }
+
+
+media_registry = MediaRegistry()
@@ -0,0 +1,12 @@
+-- Indexes for the hot queries (Gain Points link selection and /summery stats).
+-- views(user_id, ...) is already served by the (user_id, post_id) primary key.
+
+-- Active posts by owner / excluding owner
+CREATE INDEX IF NOT EXISTS idx_posts_status_user ON posts(status, user_id);
+
+-- Summary: active users and sign-ups per period
+CREATE INDEX IF NOT EXISTS idx_users_last_active ON users(last_active);
+CREATE INDEX IF NOT EXISTS idx_users_date_joined ON users(date_joined);
+
+-- Payment history per user
+CREATE INDEX IF NOT EXISTS idx_payments_user ON payments(user_id);
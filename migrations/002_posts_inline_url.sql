@@ -0,0 +1,3 @@
+-- Keep the link URL on the post row so Gain Points never reads storage files.
+-- owner (user_id), status and date_posted are already columns.
+ALTER TABLE posts ADD COLUMN url TEXT;
@@ -0,0 +1,41 @@
+"""
+Backfill posts.url from file storage: 'posts_N.json:index' shard refs and
+legacy per-post '<uuid>.json' files. Each shard is parsed at most once.
+"""
+import json
+import logging
+import os
+
+POSTS_DIR = os.path.join('storage', 'posts')
+
+
+def _load_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logging.error(f"Backfill: could not read {path}: {e}")
+        return None
+
+
+async def upgrade(db):
+    async with db.execute("SELECT post_id, file_path FROM posts WHERE url IS NULL") as cursor:
+        rows = [(row[0], row[1]) async for row in cursor]
+    shards = {}
+    updates = []
+    for post_id, file_ref in rows:
+        if not file_ref:
+            continue
+        head, _, tail = file_ref.rpartition(':')
+        if head and tail.isdigit():
+            path = os.path.join(POSTS_DIR, os.path.basename(head))
+            if path not in shards:
+                shards[path] = _load_json(path)
+            posts = shards[path]
+            post = posts[int(tail)] if isinstance(posts, list) and int(tail) < len(posts) else None
+        else:
+            post = _load_json(file_ref) if os.path.exists(file_ref) else None
+        if isinstance(post, dict) and post.get('url'):
+            updates.append((post['url'], post_id))
+    await db.executemany("UPDATE posts SET url = ? WHERE post_id = ?", updates)
+    logging.info(f"Backfilled url for {len(updates)} of {len(rows)} posts")
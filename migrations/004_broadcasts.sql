@@ -0,0 +1,15 @@
+-- Broadcast progress, so an interrupted broadcast can resume where it stopped
+CREATE TABLE IF NOT EXISTS broadcasts (
+    broadcast_key TEXT PRIMARY KEY,
+    message TEXT,
+    last_user_id INTEGER DEFAULT 0, -- every user up to this ID has been handled
+    sent INTEGER DEFAULT 0,
+    failed INTEGER DEFAULT 0,
+    blocked INTEGER DEFAULT 0,
+    started_at TEXT,
+    updated_at TEXT,
+    finished_at TEXT
+);
+
+-- Users who blocked the bot are skipped by broadcasts
+ALTER TABLE users ADD COLUMN blocked_at TEXT;
@@ -0,0 +1,12 @@
+-- python-telegram-bot user_data / chat_data, one JSON document per user or chat (see persistence.py)
+CREATE TABLE IF NOT EXISTS user_data (
+    user_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS chat_data (
+    chat_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated_at TEXT
+);
@@ -0,0 +1,9 @@
+-- Telegram file_id of each static media file the bot has uploaded, keyed by content hash
+CREATE TABLE IF NOT EXISTS media_assets (
+    content_hash TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    file_unique_id TEXT,
+    path TEXT,
+    uploaded_at TEXT
+);
@@ -0,0 +1,106 @@
+"""
+ocr_cache.py
+Cache of screenshot verification results so resent screenshots skip the download and OCR.
+Looked up by Telegram file_unique_id before downloading, then by perceptual hash after.
+"""
+import io
+
+from PIL import Image, ImageOps
+
+from ttl_cache import TTLCache
+
+VERIFICATION_CACHE_TTL = 3600  # seconds
+VERIFICATION_CACHE_SIZE = 2048
+# dHash bits that may differ for two screenshots to count as the same image
+PHASH_MAX_DISTANCE = 4
+HASH_SIZE = 8
+# Passing screenshots remembered per user for hash matching
+PER_USER_HASHES = 8
+
+
+def perceptual_hash(image_bytes):
+    """64-bit difference hash (dHash) of an image."""
+    image = Image.open(io.BytesIO(image_bytes))
+    # JPEG can decode straight to a reduced size, which keeps this cheap on the event loop
+    image.draft('L', (HASH_SIZE * 8, HASH_SIZE * 8))
+    small = ImageOps.grayscale(image).resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            right = pixels[row * (HASH_SIZE + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+class VerificationCache:
+    """
+    TTL + size-bounded LRU of verification results ({'installation_id', 'version', 'signout'}).
+    A file_unique_id is the exact same file, so that lookup is global and returns any result.
+    Near-identical screenshots match when their dHashes differ by at most PHASH_MAX_DISTANCE
+    bits; only passing results are kept for that, so a user who fixes a rejected screenshot
+    and resends a similar one gets a fresh OCR. Hash matches are scoped to the sending user,
+    since everyone's settings screen looks alike, and only that user's entries are compared.
+    """
+
+    def __init__(self, ttl=VERIFICATION_CACHE_TTL, max_entries=VERIFICATION_CACHE_SIZE,
+                 max_distance=PHASH_MAX_DISTANCE, per_user=PER_USER_HASHES):
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.per_user = per_user
+        self.file_hits = 0
+        self.hash_hits = 0
+        self.misses = 0
+        # file_unique_id -> result; user_id -> TTLCache of phash -> result (passing only)
+        self._by_file = TTLCache(ttl=ttl, max_size=max_entries)
+        self._by_user = TTLCache(ttl=ttl, max_size=max_entries)
+
+    @staticmethod
+    def passed(result):
+        return bool(result.get('installation_id') and result.get('version') and result.get('signout'))
+
+    def get_by_file(self, file_unique_id):
+        result = self._by_file.get(file_unique_id)
+        if result is not None:
+            self.file_hits += 1
+        return result
+
+    def get_by_hash(self, user_id, phash):
+        hashes = self._by_user.get(user_id)
+        result = None
+        if hashes is not None:
+            result = hashes.get(phash)
+            if result is None:
+                result = next(
+                    (r for other, r in hashes.items() if (other ^ phash).bit_count() <= self.max_distance), None
+                )
+        if result is None:
+            self.misses += 1
+            return None
+        self.hash_hits += 1
+        return result
+
+    def put(self, user_id, file_unique_id, phash, result):
+        if file_unique_id:
+            self._by_file[file_unique_id] = dict(result)
+        if not self.passed(result):
+            return
+        hashes = self._by_user.get(user_id)
+        if hashes is None:
+            hashes = TTLCache(ttl=self.ttl, max_size=self.per_user)
+        hashes[phash] = dict(result)
+        # Re-set so the user's entry lives as long as their newest screenshot
+        self._by_user[user_id] = hashes
+
+    def stats(self):
+        return {
+            'file_hits': self.file_hits,
+            'hash_hits': self.hash_hits,
+            'misses': self.misses,
+            'by_file': self._by_file.stats(),
+            'by_user': self._by_user.stats(),
+        }
+
+
+verification_cache = VerificationCache()
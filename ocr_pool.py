@@ -0,0 +1,182 @@
+"""
+ocr_pool.py
+Runs Tesseract OCR in a bounded process pool so screenshots never block the event loop.
+"""
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image
+
+from ocr_preprocess import OCR_MODE_RAW, ocr_image
+
+OCR_WORKERS = os.cpu_count() or 1
+# Jobs allowed to wait for a free worker before new ones are turned away
+OCR_QUEUE_SIZE = OCR_WORKERS * 4
+# Seconds Tesseract may run on one screenshot before it is killed
+OCR_JOB_TIMEOUT = 20
+# How often screenshot_handler retries when the queue is full, and the pause between tries
+OCR_BUSY_RETRIES = 3
+OCR_BUSY_RETRY_DELAY = 2
+# Recent job latencies kept for the p50/p95 figures in stats()
+LATENCY_WINDOW = 200
+
+
+class OCRBusy(Exception):
+    """The OCR queue is full; try again shortly."""
+
+
+class OCRTimeout(Exception):
+    """Tesseract did not finish within OCR_JOB_TIMEOUT."""
+
+
+def _ocr_worker(image_bytes, timeout, mode):
+    # Runs in a worker process
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        return ocr_image(image, timeout, mode)
+    except RuntimeError:
+        raise
+    except Exception as e:
+        # pytesseract's exception classes can't be unpickled in the parent, which would
+        # surface as BrokenProcessPool; send back a plain error instead
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+
+class OCRPool:
+    """
+    Process pool with an explicit waiting queue: at most `workers` jobs run at once,
+    at most `max_queue` wait for a slot, and anything beyond that raises OCRBusy.
+    """
+
+    def __init__(self, workers=OCR_WORKERS, max_queue=OCR_QUEUE_SIZE, timeout=OCR_JOB_TIMEOUT):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.rejected = 0
+        self._executor = None
+        self._slots = None
+        self._waiting = 0
+        self._running = 0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def _ensure_started(self):
+        if self._executor is None:
+            # spawn: forking a process that already runs aiosqlite/network threads is unsafe
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+            )
+            self._slots = asyncio.Semaphore(self.workers)
+
+    async def image_to_string(self, image_bytes, mode=OCR_MODE_RAW):
+        """OCR an image in a worker process (see ocr_preprocess for modes). Raises OCRBusy or OCRTimeout."""
+        self._ensure_started()
+        if self._waiting >= self.max_queue:
+            self.rejected += 1
+            raise OCRBusy()
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+        self._running += 1
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        executor = self._executor
+        try:
+            future = executor.submit(_ocr_worker, bytes(image_bytes), self.timeout, mode)
+        except BaseException as e:
+            self._release_slot()
+            if isinstance(e, BrokenProcessPool):
+                self.failed += 1
+                self._reset_executor(executor)
+            raise
+        try:
+            text = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout + 5)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise OCRTimeout()
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM); start a fresh pool on the next job. Checked before
+            # RuntimeError, which BrokenProcessPool subclasses
+            self.failed += 1
+            self._reset_executor(executor)
+            raise
+        except RuntimeError as e:
+            # pytesseract reports its own kill as RuntimeError('Tesseract process timeout')
+            if 'timeout' in str(e).lower():
+                self.timed_out += 1
+                raise OCRTimeout() from e
+            self.failed += 1
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            if future.done():
+                self._release_slot()
+            else:
+                # Timed out or cancelled while the worker is still busy: keep its slot until it
+                # really finishes, so abandoned jobs can't pile up in the executor's own queue
+                future.add_done_callback(lambda _: self._release_from_thread(loop))
+        elapsed = time.perf_counter() - start
+        self._latencies.append(elapsed)
+        self.completed += 1
+        logging.debug(f"OCR job took {elapsed * 1000:.0f} ms (queue depth {self._waiting})")
+        return text
+
+    def _release_slot(self):
+        self._running -= 1
+        self._slots.release()
+
+    def _release_from_thread(self, loop):
+        # Done-callbacks run in the executor's management thread
+        try:
+            loop.call_soon_threadsafe(self._release_slot)
+        except RuntimeError:
+            pass  # loop already closed
+
+    def stats(self):
+        latencies = sorted(self._latencies)
+
+        def pct(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else None
+
+        return {
+            'workers': self.workers,
+            'queue_depth': self._waiting,
+            'running': self._running,
+            'completed': self.completed,
+            'failed': self.failed,
+            'timed_out': self.timed_out,
+            'rejected': self.rejected,
+            'latency_p50_ms': pct(0.5),
+            'latency_p95_ms': pct(0.95),
+        }
+
+    def _reset_executor(self, broken):
+        # Every job that ran on the broken pool lands here; only the first replaces it,
+        # later ones must not shut down the new pool and the jobs already sent to it
+        if self._executor is not broken:
+            return
+        broken.shutdown(wait=False, cancel_futures=True)
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+        )
+
+    def shutdown(self):
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+ocr_pool = OCRPool()
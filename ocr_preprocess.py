@@ -0,0 +1,112 @@
+"""
+ocr_preprocess.py
+Image preparation for verification screenshots: pick a small-enough photo size,
+grayscale + binarize, crop to the content, and OCR in strips until every marker is found.
+This is the opt-in "preprocessed" ocr_mode; "raw" stays the default until
+benchmarks/bench_ocr.py has been run against it.
+"""
+import time
+
+from PIL import Image, ImageOps
+import pytesseract
+
+from extractors import has_all_markers
+
+OCR_MODE_RAW = 'raw'  # largest photo, whole image, no preprocessing (the original path)
+OCR_MODE_PREPROCESSED = 'preprocessed'
+OCR_MODES = (OCR_MODE_RAW, OCR_MODE_PREPROCESSED)
+
+# Telegram scales a photo so its longest side is 320/800/1280/2560px, so a phone
+# screenshot's sizes are about 150/370/590px wide before the original. The smallest
+# size whose short side reaches this is the 1280px one for 720p to 1440p screens
+OCR_MIN_SHORT_SIDE = 540
+# Larger images are scaled down to this width before OCR
+OCR_TARGET_WIDTH = 1080
+# The screen is read in this many overlapping horizontal strips, bottom first
+# (the About block with installation id / version / sign out sits at the bottom)
+OCR_STRIPS = 3
+OCR_STRIP_OVERLAP = 0.1
+
+
+def choose_photo(photo_sizes, mode=OCR_MODE_RAW):
+    """Pick the PhotoSize to download: the largest in raw mode, else the smallest with a short side of OCR_MIN_SHORT_SIDE."""
+    by_size = sorted(photo_sizes, key=lambda p: p.width * p.height)
+    if mode == OCR_MODE_RAW:
+        return by_size[-1]
+    for photo in by_size:
+        if min(photo.width, photo.height) >= OCR_MIN_SHORT_SIDE:
+            return photo
+    return by_size[-1]
+
+
+def _otsu_threshold(gray):
+    histogram = gray.histogram()
+    total = sum(histogram)
+    sum_all = sum(i * h for i, h in enumerate(histogram))
+    sum_bg = weight_bg = 0
+    best, threshold = -1.0, 127
+    for i, h in enumerate(histogram):
+        weight_bg += h
+        if weight_bg == 0:
+            continue
+        weight_fg = total - weight_bg
+        if weight_fg == 0:
+            break
+        sum_bg += i * h
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_all - sum_bg) / weight_fg
+        between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+        if between > best:
+            best, threshold = between, i
+    return threshold
+
+
+def preprocess(image):
+    """Grayscale, downscale, binarize to black text on white, and crop to the content."""
+    gray = ImageOps.grayscale(image)
+    if gray.width > OCR_TARGET_WIDTH:
+        height = round(gray.height * OCR_TARGET_WIDTH / gray.width)
+        gray = gray.resize((OCR_TARGET_WIDTH, height), Image.LANCZOS)
+    threshold = _otsu_threshold(gray)
+    binary = gray.point(lambda p: 255 if p > threshold else 0, mode='L')
+    # Dark mode: mostly-black background means the text is white, so flip it
+    if sum(binary.histogram()[:128]) > binary.width * binary.height / 2:
+        binary = ImageOps.invert(binary)
+    bbox = ImageOps.invert(binary).getbbox()
+    if bbox:
+        left, top, right, bottom = bbox
+        pad = 10
+        binary = binary.crop((
+            max(0, left - pad), max(0, top - pad),
+            min(binary.width, right + pad), min(binary.height, bottom + pad)
+        ))
+    return binary
+
+
+def _strips(image):
+    height = image.height / OCR_STRIPS
+    overlap = height * OCR_STRIP_OVERLAP
+    boxes = []
+    for i in range(OCR_STRIPS):
+        top = max(0, round(i * height - overlap))
+        bottom = min(image.height, round((i + 1) * height + overlap))
+        boxes.append((0, top, image.width, bottom))
+    return reversed(boxes)
+
+
+def ocr_image(image, timeout, mode=OCR_MODE_RAW):
+    """OCR an image in the given mode; preprocessed mode stops once all markers are found."""
+    if mode == OCR_MODE_RAW:
+        return pytesseract.image_to_string(image, timeout=timeout)
+    deadline = time.monotonic() + timeout
+    prepared = preprocess(image)
+    texts = []
+    for box in _strips(prepared):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise RuntimeError('Tesseract process timeout')
+        texts.append(pytesseract.image_to_string(prepared.crop(box), timeout=remaining))
+        if has_all_markers('\n'.join(texts)):
+            break
+    # Strips were read bottom-up; return the text in reading order
+    return '\n'.join(reversed(texts))
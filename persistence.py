@@ -0,0 +1,143 @@
+"""
+persistence.py
+python-telegram-bot persistence that keeps context.user_data / chat_data in bot.db, so
+in-flight Gain Points sessions survive a restart. Nothing is read at startup: each user's
+(or chat's) data is loaded the first time one of their updates arrives. Changed entries
+are written back every SESSION_SAVE_INTERVAL seconds and on shutdown, through the DB
+write-behind queue so one round of saves lands in a single transaction.
+"""
+import json
+import logging
+import zlib
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from database import delete_session_data, flush, load_session_data, save_session_data
+from ttl_cache import TTLCache
+
+# Seconds between write-backs of changed user/chat data
+SESSION_SAVE_INTERVAL = 10
+# Checksums of what was last saved, so unchanged entries are skipped
+SAVED_CHECKSUMS_SIZE = 10000
+# Checksum recorded for keys with no stored row: the same as saving empty data
+EMPTY_CHECKSUM = zlib.crc32(b'{}')
+# Users/chats remembered as already loaded; one idle longer (or evicted) is simply loaded again
+LOADED_KEYS_IDLE = 86400
+LOADED_KEYS_SIZE = 10000
+
+
+class SQLitePersistence(BasePersistence):
+    """Lazily loaded, write-behind user_data/chat_data store; bot_data, callback data and conversations are not kept."""
+
+    def __init__(self, update_interval=SESSION_SAVE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=True, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.loaded = 0
+        self.saved = 0
+        self.skipped = 0
+        # (table, key) pairs already loaded into the Application in this process
+        self._loaded = TTLCache(ttl=LOADED_KEYS_IDLE, max_size=LOADED_KEYS_SIZE, sliding=True)
+        self._checksums = TTLCache(ttl=86400, max_size=SAVED_CHECKSUMS_SIZE)
+
+    async def _refresh(self, table, key, data):
+        if self._loaded.get((table, key)):
+            return
+        self._loaded[(table, key)] = True
+        stored = await load_session_data(table, key)
+        if stored is None:
+            self._checksums[(table, key)] = EMPTY_CHECKSUM
+            return
+        self._checksums[(table, key)] = zlib.crc32(stored.encode('utf-8'))
+        # Keys set in memory before the first load (if any) win over the stored copy
+        for name, value in json.loads(stored).items():
+            data.setdefault(name, value)
+        self.loaded += 1
+
+    async def _save(self, table, key, data):
+        try:
+            stored = json.dumps(data, sort_keys=True)
+        except (TypeError, ValueError) as e:
+            logging.warning(f"Not saving {table} for {key}: {e}")
+            return
+        checksum = zlib.crc32(stored.encode('utf-8'))
+        # Unchanged, or empty with no stored row (e.g. chat_data, which the bot doesn't use).
+        # With the checksum evicted, empty data still deletes the row: it may hold stale keys
+        if self._checksums.get((table, key)) == checksum:
+            self.skipped += 1
+            return
+        self._checksums[(table, key)] = checksum
+        if data:
+            await save_session_data(table, key, stored)
+        else:
+            await delete_session_data(table, key)
+        self.saved += 1
+
+    async def _drop(self, table, key):
+        self._loaded.pop((table, key))
+        self._checksums.pop((table, key))
+        await delete_session_data(table, key)
+
+    # Lazy loading: the Application starts with no user/chat data and refresh_* fills it in
+    async def get_user_data(self):
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def refresh_user_data(self, user_id, user_data):
+        await self._refresh('user_data', user_id, user_data)
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        await self._refresh('chat_data', chat_id, chat_data)
+
+    async def update_user_data(self, user_id, data):
+        await self._save('user_data', user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        await self._save('chat_data', chat_id, data)
+
+    async def drop_user_data(self, user_id):
+        await self._drop('user_data', user_id)
+
+    async def drop_chat_data(self, chat_id):
+        await self._drop('chat_data', chat_id)
+
+    async def flush(self):
+        # Called by the Application on shutdown after the final update_* round
+        await flush()
+        logging.info(f"Session persistence: {self.stats()}")
+
+    # Not stored
+    async def get_bot_data(self):
+        return {}
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    def stats(self):
+        return {
+            'loaded': self.loaded,
+            'saved': self.saved,
+            'skipped_unchanged': self.skipped,
+            'in_memory': len(self._loaded),
+        }
+
+
+persistence = SQLitePersistence()
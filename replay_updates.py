@@ -0,0 +1,74 @@
+"""
+replay_updates.py
+POSTs recorded Telegram update JSON at a bot running in webhook mode, the way Telegram
+would (with the X-Telegram-Bot-Api-Secret-Token header), and reports status codes and latency.
+
+Each file may hold one update object, a JSON list of updates, or one update per line (JSONL).
+    python replay_updates.py updates.json [more.jsonl ...] --url http://127.0.0.1:8443/telegram --secret $WEBHOOK_SECRET_TOKEN
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+
+def load_updates(path):
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    return data if isinstance(data, list) else [data]
+
+
+def post_update(url, secret, update):
+    request = urllib.request.Request(
+        url, data=json.dumps(update).encode('utf-8'), method='POST',
+        headers={'Content-Type': 'application/json'}
+    )
+    if secret:
+        request.add_header('X-Telegram-Bot-Api-Secret-Token', secret)
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except urllib.error.URLError as e:
+        status = f"error: {e.reason}"
+    return status, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--url', default='http://127.0.0.1:8443/telegram')
+    parser.add_argument('--secret', default=os.environ.get('WEBHOOK_SECRET_TOKEN'))
+    parser.add_argument('--concurrency', type=int, default=1, help='updates in flight at once')
+    parser.add_argument('--repeat', type=int, default=1, help='send the whole set this many times')
+    args = parser.parse_args()
+
+    updates = [u for path in args.files for u in load_updates(path)] * args.repeat
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda u: post_update(args.url, args.secret, u), updates))
+    elapsed = time.perf_counter() - start
+
+    statuses = Counter(status for status, _ in results)
+    latencies = sorted(latency for _, latency in results)
+    print(f"{len(results)} updates in {elapsed:.2f}s ({len(results) / elapsed:.1f}/s)")
+    print("status: " + ", ".join(f"{status} x{count}" for status, count in statuses.items()))
+    if latencies:
+        print(f"latency p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+              f"p95 {latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000:.1f} ms")
+    return 0 if set(statuses) == {200} else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+"""
+sender.py
+Outgoing-message layer shared by every handler. All send/edit Bot API calls pass through
+one global and one per-chat token bucket, flood-control and network errors are retried
+with jittered exponential backoff until a deadline, and retry/drop counters are kept.
+"""
+import asyncio
+import logging
+import random
+import time
+from datetime import timedelta
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+from telegram.ext import BaseRateLimiter
+
+from ttl_cache import TTLCache
+
+# Telegram's limits: ~30 messages/s per bot, ~1/s per private chat (short bursts are
+# tolerated) and 20/minute per group
+SEND_GLOBAL_RATE = 30
+SEND_CHAT_RATE = 1
+SEND_CHAT_BURST = 3
+SEND_GROUP_RATE = 20 / 60
+# Seconds a single call may spend retrying before the error is passed on
+SEND_DEADLINE = 10
+SEND_BASE_BACKOFF = 0.5
+SEND_MAX_BACKOFF = 4
+# Per-chat buckets are dropped after this long unused, or least recently used first beyond CHAT_BUCKETS_MAX
+CHAT_BUCKET_IDLE = 300
+CHAT_BUCKETS_MAX = 5000
+# Only these calls are limited and retried (getUpdates, getFile etc. go straight through)
+LIMITED_ENDPOINTS = ('send', 'edit', 'copy', 'forward')
+
+
+class TokenBucket:
+    """Async token bucket; pause() stops every caller, e.g. for the duration of a RetryAfter."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    self._updated = time.monotonic()
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def retry_after_seconds(error):
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+def backoff_delay(attempt, base=SEND_BASE_BACKOFF, cap=SEND_MAX_BACKOFF):
+    """Exponential backoff with equal jitter: half fixed, half random."""
+    delay = min(cap, base * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class SendLimiter(BaseRateLimiter):
+    """
+    Rate limiter installed on the Application, so it covers every send/edit call.
+    RetryAfter pauses that chat's bucket (the global one if there is no chat) for the
+    time Telegram asks; timeouts and network errors back off. Bad requests, Forbidden
+    and anything else are raised at once. Pass a number as `rate_limit_args` to use a
+    different deadline for one call.
+    """
+
+    def __init__(self, global_rate=SEND_GLOBAL_RATE, chat_rate=SEND_CHAT_RATE,
+                 group_rate=SEND_GROUP_RATE, deadline=SEND_DEADLINE):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.deadline = deadline
+        self.sent = 0
+        self.retried = 0
+        self.flood_waits = 0
+        self.timeouts = 0
+        self.gave_up = 0
+        self.rejected = 0
+        self.dropped = 0
+        self._loop = None
+        self._global = None
+        self._chats = TTLCache(ttl=CHAT_BUCKET_IDLE, max_size=CHAT_BUCKETS_MAX, sliding=True)
+
+    async def initialize(self):
+        self._loop = asyncio.get_running_loop()
+        self._global = TokenBucket(self.global_rate, self.global_rate)
+
+    async def shutdown(self):
+        self._chats.clear()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Negative chat IDs are groups and channels
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = TokenBucket(self.group_rate, 1)
+            else:
+                bucket = TokenBucket(self.chat_rate, SEND_CHAT_BURST)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        # The bot may be used from another event loop (e.g. BackupManager's asyncio.run)
+        if (self._loop is None or asyncio.get_running_loop() is not self._loop
+                or not endpoint.startswith(LIMITED_ENDPOINTS)):
+            return await callback(*args, **kwargs)
+        chat_id = data.get('chat_id')
+        chat_bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+        deadline = time.monotonic() + (rate_limit_args if isinstance(rate_limit_args, (int, float)) else self.deadline)
+        attempt = 0
+        while True:
+            # Chat first, so a throttled chat doesn't sit on global tokens
+            if chat_bucket is not None:
+                await chat_bucket.acquire()
+            await self._global.acquire()
+            try:
+                result = await callback(*args, **kwargs)
+                self.sent += 1
+                return result
+            except RetryAfter as e:
+                self.flood_waits += 1
+                delay = retry_after_seconds(e)
+                if time.monotonic() + delay > deadline:
+                    self.gave_up += 1
+                    raise
+                (chat_bucket or self._global).pause(delay)
+                logging.warning(f"{endpoint} to {chat_id}: flood control, waiting {delay:.0f}s")
+            except BadRequest:
+                self.rejected += 1
+                raise
+            except NetworkError as e:
+                # Includes TimedOut; a timed-out send may still have been delivered
+                self.timeouts += 1
+                delay = backoff_delay(attempt)
+                if time.monotonic() + delay > deadline:
+                    self.gave_up += 1
+                    raise
+                logging.debug(f"{endpoint} to {chat_id} failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+            except TelegramError:
+                self.rejected += 1
+                raise
+            self.retried += 1
+            attempt += 1
+
+    def stats(self):
+        return {
+            'sent': self.sent,
+            'retried': self.retried,
+            'flood_waits': self.flood_waits,
+            'timeouts': self.timeouts,
+            'gave_up': self.gave_up,
+            'rejected': self.rejected,
+            'dropped': self.dropped,
+            'chat_buckets': self._chats.stats(),
+        }
+
+
+send_limiter = SendLimiter()
+
+
+async def send_reply(send_func, *args, **kwargs):
+    """Call a send/edit method; retries happen in send_limiter, so give up quietly on error and return None."""
+    try:
+        return await send_func(*args, **kwargs)
+    except Exception as e:
+        send_limiter.dropped += 1
+        logging.warning(f"Dropped message from {getattr(send_func, '__name__', send_func)}: {e}")
+        return None
@@ -0,0 +1,256 @@
+"""
+storage_backends.py
+Where backups are stored. Every backend has the same four calls (upload, download, list,
+delete) on flat object names, so BackupManager and IncrementalBackup don't care whether
+the objects end up in a Google Drive folder or a local directory.
+
+DriveBackend builds its Drive client once and keeps a name -> file id map, so an upload or
+download is one API request instead of a client build plus a files().list lookup.
+LocalBackend needs no network and is what the benchmarks (and setups without Drive) use.
+"""
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+# BACKUP_BACKEND=drive|local picks the backend; without it Drive is used when configured
+BACKUP_BACKEND = os.environ.get('BACKUP_BACKEND')
+BACKUP_LOCAL_DIR = os.environ.get('BACKUP_LOCAL_DIR', os.path.join('.backup', 'remote'))
+DRIVE_SCOPES = ["https://www.googleapis.com/auth/drive"]
+# Page size of the folder listing that fills DriveBackend's id map
+DRIVE_LIST_PAGE_SIZE = 1000
+
+
+class StorageBackend:
+    """Flat object store: upload/download whole files by name."""
+
+    def upload(self, local_path, remote_name):
+        """Create or overwrite `remote_name` with the contents of `local_path`."""
+        raise NotImplementedError
+
+    def download(self, remote_name, local_path):
+        """Write `remote_name` to `local_path`; returns False if there is no such object."""
+        raise NotImplementedError
+
+    def list(self):
+        """Names of all stored objects."""
+        raise NotImplementedError
+
+    def delete(self, remote_name):
+        """Remove `remote_name`; returns False if there was no such object."""
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+
+class LocalBackend(StorageBackend):
+    """Objects are plain files in one directory; writes go through a temp file and os.replace."""
+
+    def __init__(self, root=BACKUP_LOCAL_DIR):
+        self.root = root
+        self.uploads = 0
+        self.downloads = 0
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, remote_name):
+        if os.sep in remote_name or remote_name in ('', '.', '..'):
+            raise ValueError(f"Invalid object name: {remote_name!r}")
+        return os.path.join(self.root, remote_name)
+
+    def upload(self, local_path, remote_name):
+        target = self._path(remote_name)
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix='.upload-')
+        os.close(fd)
+        try:
+            shutil.copyfile(local_path, tmp)
+            os.replace(tmp, target)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self.uploads += 1
+
+    def download(self, remote_name, local_path):
+        source = self._path(remote_name)
+        if not os.path.exists(source):
+            return False
+        shutil.copyfile(source, local_path)
+        self.downloads += 1
+        return True
+
+    def list(self):
+        return [name for name in os.listdir(self.root) if not name.startswith('.upload-')]
+
+    def delete(self, remote_name):
+        try:
+            os.remove(self._path(remote_name))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def stats(self):
+        return {'backend': 'local', 'root': self.root, 'uploads': self.uploads, 'downloads': self.downloads}
+
+
+class DriveBackend(StorageBackend):
+    """
+    Objects are files in one Drive folder. Credentials are parsed and the client built on
+    first use, once per thread (the underlying httplib2 connection isn't thread-safe).
+    The name -> id map is filled by one paginated listing of the folder and then kept up
+    to date by our own creates/deletes; an id that has gone stale (file removed by hand)
+    is dropped and the listing reloaded once.
+    """
+
+    def __init__(self, folder_id=None, service_account_json=None):
+        self.folder_id = folder_id or os.environ.get('GDRIVE_FOLDER_ID')
+        self.service_account_json = service_account_json or os.environ.get('GDRIVE_SERVICE_ACCOUNT_JSON')
+        if not self.folder_id:
+            raise RuntimeError("GDRIVE_FOLDER_ID not set. Set it as an environment variable.")
+        if not self.service_account_json:
+            raise RuntimeError("Missing Google Drive service account JSON (set as secret: GDRIVE_SERVICE_ACCOUNT_JSON)")
+        self.requests = 0
+        self.listings = 0
+        self.stale_ids = 0
+        self._credentials = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._ids = None
+
+    def _service(self):
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            from google.oauth2 import service_account
+            from googleapiclient.discovery import build
+            with self._lock:
+                if self._credentials is None:
+                    self._credentials = service_account.Credentials.from_service_account_info(
+                        json.loads(self.service_account_json), scopes=DRIVE_SCOPES
+                    )
+            service = self._local.service = build(
+                "drive", "v3", credentials=self._credentials, cache_discovery=False
+            )
+        return service
+
+    def _execute(self, request):
+        self.requests += 1
+        return request.execute()
+
+    def _load_ids(self):
+        ids = {}
+        page_token = None
+        while True:
+            results = self._execute(self._service().files().list(
+                q=f"'{self.folder_id}' in parents and trashed=false",
+                fields="nextPageToken, files(id, name)",
+                pageSize=DRIVE_LIST_PAGE_SIZE,
+                pageToken=page_token,
+            ))
+            for f in results.get("files", []):
+                # Duplicate names: keep the first, as the old name query did
+                ids.setdefault(f["name"], f["id"])
+            page_token = results.get("nextPageToken")
+            if not page_token:
+                break
+        self.listings += 1
+        with self._lock:
+            self._ids = ids
+        return ids
+
+    def _file_id(self, remote_name):
+        ids = self._ids if self._ids is not None else self._load_ids()
+        return ids.get(remote_name)
+
+    def _forget(self, remote_name):
+        self.stale_ids += 1
+        with self._lock:
+            if self._ids is not None:
+                self._ids.pop(remote_name, None)
+
+    @staticmethod
+    def _is_not_found(error):
+        from googleapiclient.errors import HttpError
+        return isinstance(error, HttpError) and error.resp.status == 404
+
+    def upload(self, local_path, remote_name):
+        from googleapiclient.http import MediaFileUpload
+        file_id = self._file_id(remote_name)
+        if file_id is not None:
+            try:
+                self._execute(self._service().files().update(
+                    fileId=file_id, media_body=MediaFileUpload(local_path, resumable=True)
+                ))
+                return
+            except Exception as e:
+                if not self._is_not_found(e):
+                    raise
+                self._forget(remote_name)
+        created = self._execute(self._service().files().create(
+            body={"name": remote_name, "parents": [self.folder_id]},
+            media_body=MediaFileUpload(local_path, resumable=True),
+            fields="id",
+        ))
+        with self._lock:
+            self._ids[remote_name] = created["id"]
+
+    def download(self, remote_name, local_path, _retry=True):
+        from googleapiclient.http import MediaIoBaseDownload
+        file_id = self._file_id(remote_name)
+        if file_id is None:
+            return False
+        try:
+            with open(local_path, "wb") as f:
+                downloader = MediaIoBaseDownload(f, self._service().files().get_media(fileId=file_id))
+                self.requests += 1
+                done = False
+                while not done:
+                    _, done = downloader.next_chunk()
+        except Exception as e:
+            if not self._is_not_found(e):
+                raise
+            self._forget(remote_name)
+            if not _retry:
+                return False
+            # Maybe re-created under a new id since the map was loaded
+            self._load_ids()
+            return self.download(remote_name, local_path, _retry=False)
+        return True
+
+    def list(self):
+        return sorted(self._load_ids())
+
+    def delete(self, remote_name):
+        file_id = self._file_id(remote_name)
+        if file_id is None:
+            return False
+        try:
+            self._execute(self._service().files().delete(fileId=file_id))
+        except Exception as e:
+            if not self._is_not_found(e):
+                raise
+        with self._lock:
+            self._ids.pop(remote_name, None)
+        return True
+
+    def stats(self):
+        return {
+            'backend': 'drive',
+            'requests': self.requests,
+            'listings': self.listings,
+            'stale_ids': self.stale_ids,
+            'cached_ids': len(self._ids or ()),
+        }
+
+
+def get_backend(name=BACKUP_BACKEND):
+    """The configured backend: `name` if given, else Drive when its env vars are set, else local."""
+    if name is None:
+        name = 'drive' if os.environ.get('GDRIVE_FOLDER_ID') and os.environ.get('GDRIVE_SERVICE_ACCOUNT_JSON') else 'local'
+        if name == 'local':
+            logging.warning(f"Google Drive is not configured; backups go to {BACKUP_LOCAL_DIR}")
+    if name == 'drive':
+        return DriveBackend()
+    if name == 'local':
+        return LocalBackend()
+    raise ValueError(f"Unknown BACKUP_BACKEND: {name}")
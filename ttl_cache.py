@@ -0,0 +1,102 @@
+"""
+ttl_cache.py
+Bounded in-memory map for ephemeral per-user state: entries expire after a TTL and the
+least recently used ones are evicted beyond max_size, so long uptimes don't leak memory.
+"""
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Dict-like TTL + LRU container with O(1) get/set. Expired entries are dropped when read
+    (lazy) and by a full sweep at most every `sweep_interval` seconds, run from set() so no
+    background task is needed. With sliding=True a successful get() also restarts the TTL.
+    """
+
+    def __init__(self, ttl, max_size, sweep_interval=None, sliding=False):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.sliding = sliding
+        self.sweep_interval = ttl if sweep_interval is None else sweep_interval
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        # key -> (expires_at, value), least recently used first
+        self._data = OrderedDict()
+        self._next_sweep = time.monotonic() + self.sweep_interval
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        now = time.monotonic()
+        if entry[0] <= now:
+            del self._data[key]
+            self.expired += 1
+            self.misses += 1
+            return default
+        if self.sliding:
+            self._data[key] = (now + self.ttl, entry[1])
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value, ttl=None):
+        now = time.monotonic()
+        self._data[key] = (now + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        if now >= self._next_sweep:
+            self.sweep(now)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evicted += 1
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        if entry is None or entry[0] <= time.monotonic():
+            return default
+        return entry[1]
+
+    def sweep(self, now=None):
+        """Drop every expired entry; returns how many were removed."""
+        now = time.monotonic() if now is None else now
+        stale = [key for key, (expires_at, _) in self._data.items() if expires_at <= now]
+        for key in stale:
+            del self._data[key]
+        self.expired += len(stale)
+        self._next_sweep = now + self.sweep_interval
+        return len(stale)
+
+    def items(self):
+        """Live (key, value) pairs, least recently used first; doesn't count as a use."""
+        now = time.monotonic()
+        return [(key, value) for key, (expires_at, value) in self._data.items() if expires_at > now]
+
+    def clear(self):
+        self._data.clear()
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        del self._data[key]
+
+    def __contains__(self, key):
+        entry = self._data.get(key)
+        return entry is not None and entry[0] > time.monotonic()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'expired': self.expired,
+            'evicted': self.evicted,
+        }
@@ -0,0 +1,67 @@
+"""
+update_processor.py
+Concurrent update dispatch with per-user ordering: updates from different users are handled
+in parallel, while each user's updates run one at a time in the order they arrived.
+"""
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from keyed_locks import KeyedLocks
+
+# Updates handled at the same time across all users
+MAX_CONCURRENT_UPDATES = 64
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Serializes updates per user (per chat when there is no user). The user lock is taken
+    before a concurrency slot, so one user's backlog never occupies slots others could use.
+    Pre-checkout queries skip the lock: Telegram cancels the payment if they aren't answered
+    within 10 seconds, and they don't change any state.
+    """
+
+    def __init__(self, max_concurrent_updates=MAX_CONCURRENT_UPDATES):
+        super().__init__(max_concurrent_updates)
+        self.locks = KeyedLocks()
+        self.processed = 0
+
+    @staticmethod
+    def _key(update):
+        if not isinstance(update, Update) or update.pre_checkout_query:
+            return None
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    async def process_update(self, update, coroutine):
+        key = self._key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+        async with self.locks.hold(key):
+            await super().process_update(update, coroutine)
+
+    async def do_process_update(self, update, coroutine):
+        try:
+            await coroutine
+        finally:
+            self.processed += 1
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def stats(self):
+        return {
+            'max_concurrent': self.max_concurrent_updates,
+            'users_active': len(self.locks),
+            'waiting': self.locks.waiting(),
+            'processed': self.processed,
+        }
+
+
+update_processor = PerUserUpdateProcessor()